@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+
+# Times the hot paths of ReCP against synthetic histories and .recp files:
+# history parsing, the parsed history cache, deduplication, recipe loading, a search typed one key at a time
+# and rendering on a fake curses screen. Results are saved as JSON to be compared across commits.
+#
+#   python3 benchmarks/benchmark.py                              # 1k, 100k and 1M entries
+#   python3 benchmarks/benchmark.py --sizes 1000,100000 --output before.json
+#   python3 benchmarks/benchmark.py --sizes 1000,100000 --compare before.json
+
+import curses
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SIZES = [1000, 100000, 1000000]
+DEFAULT_REPEAT = 3
+SEARCH_KEYS = "git co"
+FUZZY_SEARCH_KEYS = "dkrps"
+SCREEN_SIZE = (50, 120) # height, width
+SCROLLED_FRAMES = 100
+
+
+#
+# Synthetic data
+#
+
+PROGRAMS = {
+    "git": ["status", "commit -m 'fix {word}'", "checkout -b {word}/{number}", "log --oneline -n {number}", "diff HEAD~{number}", "push origin {word}"],
+    "docker": ["ps -a", "run --rm -it {word}:{number}", "logs -f {word}", "exec -it {word} sh", "compose up -d {word}"],
+    "kubectl": ["get pods -n {word}", "describe pod {word}-{number}", "logs {word}-{number} -f", "rollout restart deploy/{word}"],
+    "cd": ["~/src/{word}", "../{word}", "/var/log/{word}"],
+    "make": ["test", "build", "{word}", "-j{number} {word}"],
+    "ssh": ["{word}@host-{number}", "-L {number}:localhost:{number} {word}"],
+    "python3": ["-m pytest tests/{word}_test.py", "-m http.server {number}", "{word}.py --verbose"],
+    "vim": ["{word}.py", "~/.{word}rc", "src/{word}/main.c"],
+    "grep": ["-rn '{word}' src", "-i {word} /var/log/syslog"],
+    "echo": ["'{word} ünïcödé {number}'", "\"$HOME/{word}\""],
+}
+WORDS = ["alpha", "build", "cache", "deploy", "editor", "feature", "gateway", "history", "index", "journal", "kernel", "loader", "metrics", "network", "output", "parser", "query", "render", "search", "terminal"]
+
+
+# Returns count commands drawn from a vocabulary, with the repetitions of a real history (about a third are unique)
+def syntheticCommands(count, seed = 1):
+    generator = random.Random(seed)
+    programs = list(PROGRAMS)
+    unique = max(count // 3, 1)
+    vocabulary = []
+    for _ in range(unique):
+        program = generator.choice(programs)
+        arguments = generator.choice(PROGRAMS[program]).format(word = generator.choice(WORDS), number = generator.randrange(1, 10000))
+        vocabulary.append(f"{program} {arguments}")
+    # a few multi line commands, which both formats store with escaped newlines
+    for i in range(0, unique, 500):
+        vocabulary[i] = f"{vocabulary[i]} \\\n  && echo done"
+    # recent commands are repeated more often than old ones
+    return [ vocabulary[min(int(generator.paretovariate(1.2)) - 1, unique - 1) if generator.random() < 0.5 else generator.randrange(unique)] for _ in range(count) ]
+
+
+def writeZshHistory(path, commands):
+    with open(path, 'w') as file:
+        timestamp = 1700000000
+        for command in commands:
+            timestamp += 7
+            file.write(f": {timestamp}:0;{command}\n")
+
+
+def writeBashHistory(path, commands):
+    with open(path, 'w') as file:
+        timestamp = 1700000000
+        for command in commands:
+            timestamp += 7
+            file.write(f"#{timestamp}\n{command}\n")
+
+
+def writeRecipes(path, commands):
+    recipes = [ { 'title': f"recipe {i}", 'recipe': command } for i, command in enumerate(commands) ]
+    with open(path, 'w') as file:
+        json.dump({ 'recipes': recipes }, file)
+
+
+HISTORY_WRITERS = {
+    "zsh": (".zsh_history", writeZshHistory),
+    "bash": (".bash_history", writeBashHistory)
+}
+
+
+#
+# Fake curses screen
+#
+
+# Stands in for a curses window. Keeps the number of characters written so a frame can be measured without a terminal
+class FakeWindow:
+    written = 0
+
+    def __init__(self, height, width):
+        self.height = height
+        self.width = width
+
+    def getmaxyx(self):
+        return (self.height, self.width)
+
+    def addstr(self, *arguments):
+        text = next(argument for argument in arguments if isinstance(argument, str))
+        FakeWindow.written += len(text)
+
+    def erase(self): pass
+    def clear(self): pass
+    def box(self): pass
+    def move(self, y, x): pass
+    def clrtoeol(self): pass
+    def touchwin(self): pass
+    def noutrefresh(self): pass
+    def refresh(self): pass
+    def attron(self, attribute): pass
+    def attroff(self, attribute): pass
+
+
+def installFakeCurses():
+    curses.newwin = lambda height, width, y = 0, x = 0: FakeWindow(height, width)
+    curses.color_pair = lambda pair: pair << 8
+    curses.doupdate = lambda: None
+    curses.curs_set = lambda visibility: None
+
+
+#
+# Measurements
+#
+
+# Runs setup then body repeat times, returns the duration of each body call in seconds
+def measure(body, repeat, setup = None):
+    durations = []
+    for _ in range(repeat):
+        state = setup() if setup is not None else None
+        start = time.perf_counter()
+        body(state)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+class Benchmark:
+    def __init__(self, recp, directory, repeat):
+        self.recp = recp
+        self.directory = directory
+        self.repeat = repeat
+        self.results = []
+
+    def record(self, name, shell, size, durations, **extra):
+        result = { 'name': name, 'shell': shell, 'size': size, 'seconds': statistics.median(durations), 'runs': durations }
+        result.update(extra)
+        self.results.append(result)
+        print(f"{name:<20}{shell:<6}{size:>10}{result['seconds'] * 1000:>12.2f} ms", flush = True)
+
+    def run(self, sizes, shells):
+        for size in sizes:
+            commands = syntheticCommands(size)
+            for shell in shells:
+                self.runHistory(shell, size, commands)
+            self.runRecipes(size, commands)
+            self.runInterface(shells[0], size)
+
+    def runHistory(self, shell, size, commands):
+        recp = self.recp
+        fileName, writer = HISTORY_WRITERS[shell]
+        path = os.path.join(self.directory, fileName)
+        writer(path, commands)
+
+        def withoutCache():
+            shutil.rmtree(recp.cacheDirectory(), ignore_errors = True)
+            return recp.HistoryStore(path)
+        self.record("history.parse", shell, size, measure(lambda store: store.load(), self.repeat, withoutCache))
+
+        recp.HistoryStore(path).load()
+        self.record("history.cached", shell, size, measure(lambda store: store.load(), self.repeat, lambda: recp.HistoryStore(path)))
+
+        loaded = recp.HistoryStore(path).load()
+        def dedupe(_):
+            index = recp.HistoryIndex()
+            index.extend(loaded.encodedItems())
+            index.commands()
+        self.record("history.dedupe", shell, size, measure(dedupe, self.repeat))
+
+    def runRecipes(self, size, commands):
+        recp = self.recp
+        projectDirectory = os.path.join(self.directory, "project")
+        os.makedirs(projectDirectory, exist_ok = True)
+        writeRecipes(os.path.join(projectDirectory, recp.CONFIG_FILE_NAME), commands[:size])
+        self.record("recipes.load", "-", size, measure(lambda _: recp.Config(projectDirectory), self.repeat))
+
+    # Search and rendering go through a ReCP instance, loaded from the history written last for this size
+    def runInterface(self, shell, size):
+        recp = self.recp
+        os.environ["SHELL"] = f"/bin/{shell}"
+        app = recp.ReCP(recp.Config(os.path.join(self.directory, "project")))
+        app.historyLoader.join()
+        screen = FakeWindow(*SCREEN_SIZE)
+
+        def firstFrame():
+            app.layout = None
+            app.rankedHistoryVersion = None
+            app.frecencies = (None, None)
+            app.recipeTuplesVersion = None
+            app.recipeRows = recp.RowLayoutCache()
+            app.historyRows = recp.RowLayoutCache()
+        self.record("render.first", shell, size, measure(lambda _: app.draw(screen), self.repeat, firstFrame))
+
+        def scroll(_):
+            app.option = -1
+            app.isInRecipeMode = False
+            for _ in range(SCROLLED_FRAMES):
+                app.handleUserInput(screen, curses.KEY_DOWN)
+                app.draw(screen)
+        FakeWindow.written = 0
+        durations = [ duration / SCROLLED_FRAMES for duration in measure(scroll, self.repeat) ]
+        self.record("render.frame", shell, size, durations, characters = FakeWindow.written // (self.repeat * SCROLLED_FRAMES))
+
+        history = app.getHistory()
+        width = SCREEN_SIZE[1] - 2
+        self.record("render.truncate", shell, size, measure(lambda _: [ recp.stringLimitedToWidth(f"[{i}] {line}", width) for i, line in enumerate(history) ], self.repeat))
+
+        self.record("search.regex", shell, size, self.measureTyping(app, screen, SEARCH_KEYS, False))
+        self.record("search.fuzzy", shell, size, self.measureTyping(app, screen, FUZZY_SEARCH_KEYS, True))
+
+    # Types the keys one at a time, each followed by the frame that shows the results. Returns the time of the whole sequence
+    def measureTyping(self, app, screen, keys, isFuzzySearch):
+        def reset():
+            app.isFuzzySearch = isFuzzySearch
+            app.recipeFilter = self.recp.SearchFilter()
+            app.historyFilter = self.recp.SearchFilter()
+            app.option = -1
+            app.userInput = app.searchQuery = ""
+            app.draw(screen)
+
+        def typing(_):
+            for key in keys:
+                app.userInput += key
+                app.searchQuery = app.userInput
+                app.draw(screen)
+        return measure(typing, self.repeat, reset)
+
+
+#
+# Main
+#
+
+def currentCommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd = REPOSITORY_DIRECTORY, capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def printComparison(results, path):
+    with open(path) as file:
+        previous = { (result['name'], result['shell'], result['size']): result['seconds'] for result in json.load(file)['results'] }
+    print(f"\n{'':<36}{'before ms':>12}{'after ms':>12}{'change':>10}")
+    for result in results:
+        key = (result['name'], result['shell'], result['size'])
+        if key not in previous:
+            continue
+        before = previous[key]
+        after = result['seconds']
+        change = f"{(after / before - 1) * 100:+.0f}%" if before > 0 else "-"
+        print(f"{result['name']:<20}{result['shell']:<6}{result['size']:>10}{before * 1000:>12.2f}{after * 1000:>12.2f}{change:>10}")
+
+
+def parsedOptions(arguments):
+    options = { '--sizes': ",".join(map(str, DEFAULT_SIZES)), '--shells': "zsh,bash", '--repeat': str(DEFAULT_REPEAT), '--output': None, '--compare': None }
+    for i in range(0, len(arguments), 2):
+        if arguments[i] not in options or i + 1 >= len(arguments):
+            print("Usage: benchmark.py [--sizes 1000,100000,1000000] [--shells zsh,bash] [--repeat 3] [--output results.json] [--compare previous.json]")
+            exit(2)
+        options[arguments[i]] = arguments[i + 1]
+    return options
+
+
+if __name__ == '__main__':
+    options = parsedOptions(sys.argv[1:])
+    commit = currentCommit()
+
+    # everything ReCP reads or writes lives in a temporary home, away from the real history, cache and daemon
+    directory = tempfile.mkdtemp(prefix = "recp-benchmark-")
+    for name, subdirectory in [("HOME", ""), ("XDG_CACHE_HOME", "cache"), ("XDG_DATA_HOME", "data"), ("XDG_RUNTIME_DIR", "runtime")]:
+        os.environ[name] = os.path.join(directory, subdirectory)
+        os.makedirs(os.environ[name], exist_ok = True)
+
+    sys.path.insert(0, REPOSITORY_DIRECTORY)
+    import recp
+    installFakeCurses()
+
+    benchmark = Benchmark(recp, directory, int(options['--repeat']))
+    try:
+        benchmark.run(list(map(int, options['--sizes'].split(","))), options['--shells'].split(","))
+    finally:
+        shutil.rmtree(directory, ignore_errors = True)
+
+    report = {
+        'commit': commit,
+        'version': recp.VERSION,
+        'date': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': benchmark.results
+    }
+    output = options['--output'] or f"benchmark-{commit or 'unknown'}.json"
+    with open(output, 'w') as file:
+        json.dump(report, file, indent = 2)
+    print(f"Saved to {output}")
+
+    if options['--compare'] is not None:
+        printComparison(benchmark.results, options['--compare'])
@@ -1,12 +1,25 @@
 #!/usr/bin/env python3
 
+import time
+STARTUP_TIME = time.perf_counter()
+
+# Only what the first frame needs is imported here, subprocess and hashlib are imported where they are used
 import curses
-import curses.ascii
-import subprocess
 import os
 import sys
 import json
 import re
+import marshal
+import heapq
+import math
+import threading
+import contextlib
+import fcntl
+import bisect
+import itertools
+import collections
+from array import array
+IMPORT_TIME = time.perf_counter()
 
 
 # EXPORT BIN TO PATH:
@@ -17,6 +30,11 @@ TITLE = "ReCP"
 CONFIG_FILE_NAME = ".recp"
 ESC_KEY = 27
 VERSION = "0.1.2"
+HISTORY_LOADING_REFRESH_SECONDS = 0.1
+FRAME_INTERVAL_SECONDS = 1 / 60
+DEBUG_PANE_HEIGHT = 15
+SEARCH_DEBOUNCE_SECONDS = 0.08
+MAX_KEYS_PER_BATCH = 256
 
 # Styles
 BACKGROUND_COLOR = curses.COLOR_BLACK
@@ -31,11 +49,34 @@ ACCENT_STYLE = (curses.COLOR_GREEN, BACKGROUND_COLOR)
 # ReCP Main class
 #
 class ReCP:
-    def __init__(self, config, isDebugEnabled = False):
+    def __init__(self, config, isDebugEnabled = False, isProfilingStartup = False, outputPath = None, tracePath = None):
         self.config = config
+        self.outputPath = outputPath # set by the shell integration, which runs the command itself
+        self.isProfilingStartup = isProfilingStartup
         self.recipes = []
         self.history = []
+        self.historyIndex = HistoryIndex()
+        self.historyStore = None
+        self.historyError = None
+        self.usageLog = UsageLog(os.path.join(dataDirectory(), "usage.log"))
+        self.directoryLog = DirectoryLog(os.path.join(dataDirectory(), DIRECTORY_LOG_NAME))
+
+        # search tuples are rebuilt only when their source changes
+        self.recipeFilter = SearchFilter()
+        self.recipeTuples = []
+        self.recipeTuplesVersion = None
+        self.parallelSearch = ParallelSearch(self.historyIndex)
+        self.historyFilter = SearchFilter(self.parallelSearch)
+        self.rankedHistory = None
+        self.rankedHistoryVersion = None
+        self.frecencies = (None, None) # (version, (id, frecency) pairs) for the search processes
+        self.isSearching = False # the search processes have not answered the current query yet
+        self.recipeView = ListView()
+        self.historyView = ListView()
+        self.recipeRows = RowLayoutCache()
+        self.historyRows = RowLayoutCache()
         self.isDebugEnabled = isDebugEnabled
+        self.metrics = FrameMetrics(tracePath)
 
         log(f"Loading {len(self.recipes)} recipes")
 
@@ -46,11 +87,36 @@ class ReCP:
         self.isInRecipeMode = True
         self.shouldHideOtherMode = False
         self.shouldShowInfo = False
+        self.isFuzzySearch = False
+        self.isHereFirst = True # commands run in the current directory or below it go first in the History pane
+        self.hereCount = 0
         self.shouldQuit = False
         self.commandToExecute = None
+        self.statusMessage = "" # shown in the status bar until the next key
+        self.clipboard = Clipboard()
         self.debug = f"Version: {VERSION}"
+
+        # rendering state, panes are created once and recreated only when the layout changes
+        self.layout = None
+        self.panes = {}
+        self.statusBar = None
+        self.needsFullRedraw = False
+        self.needsDraw = True
+        self.drawnHistoryState = None
+
+        # input scheduling, userInput is what was typed and searchQuery what the panes are filtered by
+        self.searchQuery = ""
+        self.lastKeyTime = 0
         
         os.environ.setdefault('ESCDELAY', '25') # Reduce the delay for the ESC key to be recognized
+
+        # the history is streamed into the index while the recipes are already on screen
+        self.startHistoryLoader()
+
+    def startHistoryLoader(self):
+        self.isHistoryLoading = True
+        self.historyLoader = threading.Thread(target=self.loadHistory, daemon=True)
+        self.historyLoader.start()
         
     
     def setupDisplayConfiguration(self):
@@ -68,124 +134,230 @@ class ReCP:
         # define the curses wrapper
         def character(stdscr):
             stdscr.scrollok(1)
+            self.setupDisplayConfiguration()
+            lastDrawTime = 0
 
             while self.shouldExit() == False:
-                self.draw(stdscr)
-                self.handleUserInput(stdscr)
+                now = time.monotonic()
+                # the search is only applied once typing pauses
+                if self.userInput != self.searchQuery and now - self.lastKeyTime >= SEARCH_DEBOUNCE_SECONDS:
+                    self.searchQuery = self.userInput
+                    self.needsDraw = True
+                if self.historyState() != self.drawnHistoryState or self.isSearching:
+                    self.needsDraw = True
+
+                # render at most once per frame
+                if self.needsDraw and now - lastDrawTime >= FRAME_INTERVAL_SECONDS:
+                    self.draw(stdscr)
+                    if lastDrawTime == 0:
+                        PROFILE.end("first paint")
+                        if self.isProfilingStartup:
+                            self.shouldQuit = True
+                    lastDrawTime = now
+                    self.needsDraw = False
+
+                keys = self.readKeys(stdscr, self.inputTimeout(now, lastDrawTime))
+                for i in range(len(keys)):
+                    if self.opensModal(keys[i]):
+                        # the dialog reads its own keys, give it the ones that were typed after
+                        for key in reversed(keys[i + 1:]):
+                            curses.ungetch(key)
+                        self.handleUserInput(stdscr, keys[i])
+                        break
+                    self.handleUserInput(stdscr, keys[i])
+                    if self.shouldExit():
+                        break
+                if len(keys) > 0:
+                    self.lastKeyTime = time.monotonic()
+                    self.needsDraw = True
                 
             # clean screen before exiting
             stdscr.clear()
             
 
         # Call the character function
+        PROFILE.begin("first paint")
         curses.wrapper(character)
+        self.parallelSearch.close()
+        self.metrics.close()
         self.execCommandIfAvailable()
 
     
     # Draw all the elements of the screen (Title, options, StatusBar)
+    # Panes are kept across frames and only the rows that changed are sent to the terminal, in a single update
     def draw(self, stdscr):
-        self.setupDisplayConfiguration()
+        with self.metrics.phase("frame"):
+            self.drawFrame(stdscr)
+
+    def drawFrame(self, stdscr):
+        self.drawnHistoryState = self.historyState()
+        layout = (stdscr.getmaxyx(), self.shouldHideOtherMode, self.isInRecipeMode and self.shouldHideOtherMode)
+        if layout != self.layout:
+            self.layoutPanes(stdscr)
+            self.layout = layout
+        elif self.needsFullRedraw:
+            # a modal window was drawn on top of the panes
+            for pane in self.panes.values():
+                pane.invalidate()
+        self.needsFullRedraw = False
+
+        if "Recipes" in self.panes:
+            with self.metrics.phase("drawRecipes"):
+                self.drawRecipes(self.panes["Recipes"])
+        if "History" in self.panes:
+            with self.metrics.phase("drawHistory"):
+                self.drawHistory(self.panes["History"])
+                
+        #Debug
+        self.drawDebug()
         
+        # Add the StatusBar. Refreshed last so the cursor ends up in the search field
+        height, width = stdscr.getmaxyx()
+        self.drawStatusBar(stdscr, height - 1, width)
+        with self.metrics.phase("noutrefresh"):
+            stdscr.noutrefresh()
+        with self.metrics.phase("doupdate"):
+            curses.doupdate()
+
+
+    def layoutPanes(self, stdscr):
         stdscr.erase()
-        stdscr.refresh()
+        stdscr.noutrefresh()
+        self.statusBar = None
+        self.panes = {}
 
         # Setup measurements
         height, width = stdscr.getmaxyx()
+        width = width - 2
 
-        statusY = height - 1
         # Show Recipes Only
         if self.shouldHideOtherMode:
             sectionH = height - 2
-            recipesY = 1
-            width = width - 2
-
-            # Draw onle th ecurrent selected mode
-            if self.isInRecipeMode:
-                self.drawRecipes(recipesY, width, sectionH)
-            else:
-                self.drawHistory(recipesY, width, sectionH)
+            # Draw only the current selected mode
+            name = "Recipes" if self.isInRecipeMode else "History"
+            self.panes[name] = Pane(1, 1, width, sectionH)
         else:
             sectionH = int((height - 2) / 2)
             recipesY = 1
             historyY = recipesY + sectionH
-            width = width - 2
-
-            # add the Reciped
-            self.drawRecipes(recipesY, width, sectionH)
-
-            # add the History
-            self.drawHistory(historyY, width, sectionH)
-                
-        # Add the StatusBar
-        self.drawStatusBar(stdscr, statusY, width)
-        
-        #Debug
-        self.drawDebug(stdscr)
+            self.panes["Recipes"] = Pane(1, recipesY, width, sectionH)
+            self.panes["History"] = Pane(1, historyY, width, sectionH)
+
+        if self.isDebugEnabled:
+            height, width = stdscr.getmaxyx()
+            windW = width - 10
+            windH = min(DEBUG_PANE_HEIGHT, height - 2)
+            x = int((width - windW) / 2)
+            y = int((height - windH) / 2)
+            self.panes["Debug"] = Pane(x, y, windW, windH)
         
     
-    def drawRecipes(self, y, width, height):
-        tuples = list(map(lambda x: (x, f"{x['title']} {x['recipe']}"), self.config.recipes))
-        self.recipes = self.filteredItems(tuples, height)
+    def drawRecipes(self, pane):
+        version = (self.config.version, self.usageLog.version)
+        if self.recipeTuplesVersion != version:
+            recipes = self.usageLog.ranked(self.config.recipes, lambda x: x['recipe'])
+            self.recipeTuples = list(map(lambda x: (x, f"{x['title']} {x['recipe']}"), recipes))
+            self.recipeTuplesVersion = version
+        with self.metrics.phase("filteredItems"):
+            self.recipes = self.filteredItems(self.recipeFilter, self.recipeTuples, version, lambda x: x['recipe'])
         
         title = "Recipes" 
         if self.shouldShowInfo:
             title = f"{title}   -> {self.config.source}"
             
         style = 4 if self.isInRecipeMode else 1
-        window = self.getWindow(title, 1, y, width, height, style)
+        pane.setTitle(title, style)
+
+        rows = []
         if len(self.recipes) == 0:
-            window.addstr("No Recipe found. Choose from History")
+            rows.append([("No Recipe found. Choose from History", 0)])
 
-        for i in range(len(self.recipes)):
+        # only the rows in the viewport are laid out
+        layoutKey = (pane.width, self.shouldShowInfo, self.config.version)
+        for i in self.recipeView.visibleRange(self.recipes, pane.height - 2, self.option if self.isInRecipeMode else -1):
             recipe = self.recipes[i]
-            recipeStr = f"[{i}] {recipe['title']}"
+            prefix = f"[{i}] "
+            recipeStr, infoStr = self.recipeRows.row(layoutKey, (id(recipe), prefix), lambda entry: self.recipeLayout(recipe, prefix, pane.width))
 
             style = 3 if self.isInRecipeMode and i == self.option else 1
-            window.addstr(recipeStr, curses.color_pair(style))
-            
+            row = [(recipeStr, style)]
             if self.shouldShowInfo:
-                # Limit the recipe string to the width of the screen
-                infoStr = stringLimitedToWidth(f"\t# {recipe['recipe'].strip()}", width, recipeStr)
-                window.addstr(infoStr, curses.color_pair(4))
-            if i < len(self.recipes) -1:
-                window.addstr('\n')
-        window.refresh()
+                row.append((infoStr, 4))
+            rows.append(row)
+        pane.setRows(rows)
+        pane.noutrefresh()
+
+    # The title of the recipe after its [index] prefix, and the command shown next to it with the info
+    def recipeLayout(self, recipe, prefix, width):
+        recipeStr = prefix + recipe['title']
+        if self.shouldShowInfo and len(self.config.stores) > 1:
+            # tell which of the merged files the recipe comes from
+            recipeStr = f"{recipeStr} ({self.config.label(recipe)})"
+        # Limit both strings to the width of the screen, the border takes 2 columns and the cursor 1
+        recipeStr = truncatedToWidth(recipeStr, width - 3)
+        infoStr = stringLimitedToWidth(f"\t# {recipe['recipe'].strip()}", width, recipeStr)
+        return (recipeStr, infoStr)
        
 
-    def drawHistory(self, y, width, height):
-        tuples = list(map(lambda x: (x, x), self.getHistory()))
-        self.history = self.filteredItems(tuples, height)
+    def drawHistory(self, pane):
+        with self.metrics.phase("getHistory"):
+            history = self.getHistory()
+        # the version of the snapshot, the loading thread may have added more commands since
+        version = (self.historyIndex.orderedVersion, self.usageLog.version, self.directoryLog.index.version, self.isHereFirst)
+        if self.rankedHistoryVersion != version:
+            with self.metrics.phase("rankHistory"):
+                self.rankedHistory = self.usageLog.rankedView(history, self.historyIndex)
+                # the directory log is read by the loading thread, and used once it is done
+                if self.isHereFirst and self.isHistoryLoading == False:
+                    ids = self.idsRunHere()
+                    self.rankedHistory = viewWithIdsFirst(self.rankedHistory, ids)
+                    self.hereCount = len(ids)
+                else:
+                    self.hereCount = 0
+                self.rankedHistoryVersion = version
+        with self.metrics.phase("filteredHistory"):
+            self.history = self.filteredHistory(version)
         
+        title = "History"
+        if self.hereCount > 0:
+            title = f"{title}   {self.hereCount} run here first"
+        if self.isHistoryLoading:
+            title = f"{title}   loading {len(self.historyIndex)}…"
+        if self.isSearching:
+            title = f"{title}   searching…"
+
         style = 4 if self.isInRecipeMode == False else 1
-        window = self.getWindow("History", 1, y, width, height, style)
-        if len(self.history) == 0:
-            window.addstr("No History found !!!")
+        pane.setTitle(title, style)
 
-        for i in range(len(self.history)):
-            line = self.history[i]
-            lineStr = stringLimitedToWidth(f"[{i}] {line.strip()}", width)
-            style = 3 if self.isInRecipeMode == False and i == self.option else 1
-            window.addstr(lineStr, curses.color_pair(style))
-            if i < len(self.history) -1:
-                window.addstr('\n')
+        rows = []
+        if len(self.history) == 0 and self.isHistoryLoading == False:
+            rows.append([("No History found !!!", 0)])
 
-        window.refresh()
+        for i in self.historyView.visibleRange(self.history, pane.height - 2, self.option if self.isInRecipeMode == False else -1):
+            prefix = f"[{i}] "
+            # the command of an id does not change until the index is loaded again, into new strings
+            lineStr = self.historyRows.row((pane.width, self.history.strings), (self.history.ids[i], len(prefix)), lambda entry: stringLimitedToWidth(self.history[i].strip().replace("\n", " "), pane.width, prefix))
+            style = 3 if self.isInRecipeMode == False and i == self.option else 1
+            rows.append([(prefix + lineStr, style)])
+        pane.setRows(rows)
+        pane.noutrefresh()
         
         
-    def drawDebug(self, stdscr):
-        if self.isDebugEnabled == False or len(self.debug) == 0:
+    # The last message, the size of what is shown, and how long each part of a frame took over the last frames
+    def drawDebug(self):
+        if self.isDebugEnabled == False:
             return
         
-        height, width = stdscr.getmaxyx()
-        windW = width - 10
-        windH = 4
-        x = int((width - windW) / 2)
-        y = int((height - windH) / 2)
-        win = self.getWindow("Debug", x, y, windW, windH, 4)
-        
-        win.clear()
-        win.addstr(f"{self.debug}")
-        win.refresh()
+        pane = self.panes["Debug"]
+        pane.setTitle("Debug", 4)
+        sizes = f"history {len(self.historyIndex):,} ({len(self.historyIndex.strings.buffer) / 1e6:.1f} MB) shown {len(self.history):,}   recipes {len(self.config.recipes)} shown {len(self.recipes)}   directories {len(self.directoryLog.index.directories):,}"
+        rows = [[(f"{self.debug}", 0)], [(sizes, 0)], [(f"{'ms':<18}{'last':>9}{'p50':>9}{'p95':>9}", 4)]]
+        for name, last, p50, p95 in self.metrics.summary():
+            rows.append([(f"{name:<18}{last:>9.2f}{p50:>9.2f}{p95:>9.2f}", 0)])
+        pane.setRows(rows[:pane.height - 2])
+        # the panes below may have redrawn rows under the overlay
+        pane.invalidate()
+        pane.noutrefresh()
         
     #
     # Status Bar
@@ -199,6 +371,8 @@ class ReCP:
         'S' : "[S]ave",
         'D' : "[D]elete",
         'C' : "[C]opy",
+        'F' : "[F]uzzy",
+        'W' : "[W]here",
         '/' : "[/]Search"
     }
     
@@ -236,32 +410,84 @@ class ReCP:
                 keyBindingString('S', self.option >= 0 and self.isInRecipeMode == False),
                 keyBindingString('D', self.option >= 0 and self.isInRecipeMode),
                 keyBindingString('C', self.option >= 0),
+                "[F]Regex" if self.isFuzzySearch else keyBindingString('F', True),
+                "[W]All" if self.isHereFirst else keyBindingString('W', True),
                 f"[/]Search: {self.userInput}"
             ]
+        items.insert(0, self.statusMessage)
         
         statusBar = "   ".join(filter(lambda item: len(item) > 0, items))
         if len(statusBar) > width:
             statusBar = " ".join(filter(lambda item: len(item) > 0, items))
+        # a status bar wrapping past the last line would scroll the whole screen
+        statusBar = statusBar[:width - 1]
             
-        stdscr.attron(curses.color_pair(3))
-        stdscr.addstr(y, 0, statusBar)
-        spaceLeft = width - len(statusBar) - 1
-        if spaceLeft > 0:
-            stdscr.addstr(y, len(statusBar), " " * spaceLeft)
-            if self.inputMode == 1:
-                stdscr.move(y, len(statusBar))
-        stdscr.attroff(curses.color_pair(3))      
+        if statusBar != self.statusBar:
+            self.statusBar = statusBar
+            stdscr.attron(curses.color_pair(3))
+            stdscr.addstr(y, 0, statusBar)
+            spaceLeft = width - len(statusBar) - 1
+            if spaceLeft > 0:
+                stdscr.addstr(y, len(statusBar), " " * spaceLeft)
+            stdscr.attroff(curses.color_pair(3))      
+        if self.inputMode == 1 and width - len(statusBar) - 1 > 0:
+            stdscr.move(y, len(statusBar))
         
         
 
-    # Get the option from the user input. Arrows move the current selection
-    def handleUserInput(self, stdscr):
+    # Wait for a key up to timeout milliseconds (-1 blocks), then drain everything already typed so a held arrow
+    # or a paste is applied as a single batch
+    def readKeys(self, stdscr, timeout):
+        stdscr.timeout(timeout)
         c = stdscr.getch()
+        keys = []
+        if c != -1:
+            keys.append(c)
+            stdscr.timeout(0)
+            while len(keys) < MAX_KEYS_PER_BATCH:
+                c = stdscr.getch()
+                if c == -1:
+                    break
+                keys.append(c)
+        # dialogs read with blocking getch calls
+        stdscr.timeout(-1)
+        return keys
+
+    def inputTimeout(self, now, lastDrawTime):
+        timeouts = []
+        if self.needsDraw:
+            timeouts.append(FRAME_INTERVAL_SECONDS - (now - lastDrawTime))
+        if self.userInput != self.searchQuery:
+            timeouts.append(SEARCH_DEBOUNCE_SECONDS - (now - self.lastKeyTime))
+        if self.isHistoryLoading:
+            # wake up regularly to show the rows that arrived
+            timeouts.append(HISTORY_LOADING_REFRESH_SECONDS)
+        if self.isSearching:
+            # poll the search processes once per frame
+            timeouts.append(FRAME_INTERVAL_SECONDS)
+        if len(timeouts) == 0:
+            return -1
+        return max(0, int(min(timeouts) * 1000))
+
+    def historyState(self):
+        return (self.isHistoryLoading, self.historyIndex.version)
+
+    def opensModal(self, c):
+        return self.isCharacterKey(c, 'S') or self.isCharacterKey(c, 'D')
+
+    # Get the option from the user input. Arrows move the current selection
+    def handleUserInput(self, stdscr, c):
         currentCharacter = chr(c)
+        self.statusMessage = ""
 
-        items = self.history if self.isInRecipeMode == False else list(map(lambda x: x['recipe'], self.recipes))
-        otherItems = self.history if self.isInRecipeMode else list(map(lambda x: x['recipe'], self.recipes))
+        # views, a key only reads the selected command
+        items = self.history if self.isInRecipeMode == False else RecipeCommands(self.recipes)
+        otherItems = self.history if self.isInRecipeMode else RecipeCommands(self.recipes)
         
+        if c == curses.KEY_RESIZE:
+            self.layout = None
+            return
+
         # handle the arrow keys
         if c == curses.KEY_UP:
             self.option -= 1
@@ -280,6 +506,15 @@ class ReCP:
                 else:
                     self.option = 0         
                 
+        elif c == curses.KEY_NPAGE:
+            self.option = min(self.option + self.currentView().height, len(items) - 1)
+        elif c == curses.KEY_PPAGE:
+            self.option = min(max(self.option - self.currentView().height, 0), len(items) - 1)
+        elif c == curses.KEY_HOME:
+            self.option = min(0, len(items) - 1)
+        elif c == curses.KEY_END:
+            self.option = len(items) - 1
+                
         # Handle the Tab key
         elif currentCharacter == '\t':
             self.option = 0
@@ -300,12 +535,18 @@ class ReCP:
             self.shouldShowInfo = not self.shouldShowInfo
         elif self.isCharacterKey(c, 'S'):
             self.addCommandToRecipes(stdscr, items, self.option)
+            self.needsFullRedraw = True
         elif self.isCharacterKey(c, 'D'):
             self.deleteCommandFromRecipes(stdscr, items, self.option)
+            self.needsFullRedraw = True
         elif self.isCharacterKey(c, 'C'):
-            self.queueCommandForCopy(items, self.option)
+            self.copyCommand(items, self.option)
         elif self.isCharacterKey(c, 'H'):
             self.shouldHideOtherMode = not self.shouldHideOtherMode
+        elif self.isCharacterKey(c, 'F'):
+            self.isFuzzySearch = not self.isFuzzySearch
+        elif self.isCharacterKey(c, 'W'):
+            self.isHereFirst = not self.isHereFirst
             
         elif c == curses.KEY_BACKSPACE or c == 127:
             if len(self.userInput) > 0:
@@ -318,6 +559,10 @@ class ReCP:
         
 
 
+    def currentView(self):
+        return self.recipeView if self.isInRecipeMode else self.historyView
+
+
     # Intents
 
     def shouldExit(self):
@@ -327,10 +572,13 @@ class ReCP:
     def queueCommandForExecution(self, items, option):
         if option >= 0 and option < len(items):
             self.commandToExecute = items[option]
+            self.usageLog.record(items[option], "run")
             
-    def queueCommandForCopy(self, items, option):
+    def copyCommand(self, items, option):
         if option >= 0 and option < len(items):
-            self.commandToExecute = f"echo ' {items[option].strip()} ' | pbcopy"
+            backend = self.clipboard.copy(items[option].strip())
+            self.statusMessage = f"Copied with {backend}"
+            self.usageLog.record(items[option], "copy")
     
     def addCommandToRecipes(self, stdscr, items, option):
         if self.isInRecipeMode == False and option >= 0 and option < len(items):
@@ -338,26 +586,54 @@ class ReCP:
             
     def deleteCommandFromRecipes(self, stdscr, items, option):
         if self.isInRecipeMode and option >= 0 and option < len(items):
-            self.deleteRecipe(stdscr, items[option])
+            self.deleteRecipe(stdscr, self.recipes[option])
     
     
 
 
-    def filteredItems(self, itemsSearchTuples, height):
-        if len(self.userInput) > 0:
-            
-            try:
-                p = re.compile(self.userInput, re.IGNORECASE)
-                filtered = [ s for s in itemsSearchTuples if p.match(s[1]) ]
-            except re.error:
-                filtered = list(filter(lambda tuple: self.userInput in tuple[1], itemsSearchTuples))
-                
-            filteredStrings = list(map(lambda x: x[0], filtered))
-            return listLimitedToHeight(filteredStrings, limit=height-2)
-        
-        else:
-            filteredStrings = list(map(lambda x: x[0], itemsSearchTuples))
-            return listLimitedToHeight(filteredStrings, limit=height-2)
+    def filteredItems(self, searchFilter, itemsSearchTuples, version, commandForItem):
+        if self.isFuzzySearch:
+            bonus = lambda item: self.fuzzyBonus(commandForItem(item))
+            return searchFilter.fuzzyFilter(itemsSearchTuples, version, self.searchQuery, FUZZY_RESULT_LIMIT, bonus)
+        return searchFilter.filter(itemsSearchTuples, version, self.searchQuery)
+
+    # The history is searched in its compact form, only the rows on screen are decoded
+    def filteredHistory(self, version):
+        # the loading thread cannot grow the buffer while a search scans it
+        with self.historyIndex.lock:
+            if self.isFuzzySearch:
+                history = self.historyFilter.fuzzyFilterView(self.rankedHistory, version, self.searchQuery, FUZZY_RESULT_LIMIT, self.historyBonus(version), self.historyFrecencies(version))
+            else:
+                history = self.historyFilter.filterView(self.rankedHistory, version, self.searchQuery)
+        # the previous results stay on screen until the search processes answer
+        self.isSearching = history is None
+        return self.history if history is None else history
+
+    # The frecency of the history commands used from ReCP, by id, the part of fuzzyBonus the search processes cannot look up
+    def historyFrecencies(self, version):
+        if self.frecencies[0] != version:
+            frecencies = []
+            for command in self.usageLog.scores:
+                id = self.historyIndex.idOf(command)
+                if id is not None:
+                    frecencies.append((id, self.usageLog.frecency(command)))
+            self.frecencies = (version, tuple(frecencies))
+        return self.frecencies[1]
+
+    # fuzzyBonus by id, without encoding and looking up every candidate
+    def historyBonus(self, version):
+        index = self.historyIndex
+        frecencyById = dict(self.historyFrecencies(version))
+        return lambda id: historyBonus(index.counts[id], index.sequences[id] / index.runs, frecencyById.get(id, 0))
+
+    # The ids of the history commands run in the current directory or below it, most recent first
+    def idsRunHere(self):
+        ids = map(self.historyIndex.idOf, self.directoryLog.index.commandsUnder(os.getcwd()))
+        return list(filter(lambda id: id is not None, ids))
+
+    # rank fuzzy matches by how often and how recently their command was run
+    def fuzzyBonus(self, command):
+        return commandBonus(self.historyIndex, self.usageLog, command)
         
     
     def getWindow(self, title, x, y, width, height, style = 1):
@@ -402,13 +678,10 @@ class ReCP:
                     'title': input.strip()
                 }
                    
-                allRecipes = self.config.recipes 
-                allRecipes.append(value)
-                self.config.recipes = allRecipes
-                self.config.save()
+                self.config.addRecipe(value)
                 self.option = -1
                 
-                self.debug = f"RECIPE ADDED: {len(allRecipes)} | {len(self.config.recipes)}"
+                self.debug = f"RECIPE ADDED: {len(self.config.recipes)}"
                 
                 return
             else:
@@ -426,7 +699,7 @@ class ReCP:
         
         
         win.clear()
-        recipeS = stringLimitedToWidth(f"Recipe: {recipe.strip()}", windW)
+        recipeS = stringLimitedToWidth(f"Recipe: {recipe['recipe'].strip()}", windW)
         win.addstr(recipeS)
         win.addstr(f"\nAre you sure you want to delete? [y]es/[N]o")
         win.refresh()
@@ -437,8 +710,7 @@ class ReCP:
             c = stdscr.getch()
             cs = chr(c).lower()
             if cs == 'y':
-                self.config.recipes = list(filter(lambda x: x['recipe'] != recipe, self.config.recipes))
-                self.config.save()
+                self.config.removeRecipe(recipe)
                 self.option = -1
                 
                 self.debug = f"RECIPE REMOVED: {len(self.config.recipes)}"
@@ -448,25 +720,45 @@ class ReCP:
                 return
 
 
-    def getHistory(self): # TODO: REMOVE
-        # get list of recent executed commands
-        recent = subprocess.run("fc -l -250 | cut -c 8-", shell = True, capture_output = True, text = True)
-        
-        shell_map = { "/bin/zsh" : ".zsh_history", "/bin/bash" : ".bash_history" }
-        shell = os.environ["SHELL"]
-
-        fullPath = os.path.join(os.environ["HOME"], shell_map[shell])
-        with open(fullPath, 'r', encoding='utf-8', errors='replace') as file:
-            history = file.readlines()
-        
-        history.reverse()
-        # prepend recent history to history
-        history = recent.stdout.split("\n") + history
-
-        # remove duplicates and keep the order intact
-        uniqueHistory = []
-        [uniqueHistory.append(x) for x in history if x not in uniqueHistory]
-        return uniqueHistory
+    def loadHistory(self):
+        PROFILE.begin("history load")
+        try:
+            # a running daemon already has the history parsed and deduplicated, the files are only tailed from
+            # where they end now, before the daemon reads them, so no command is missed
+            self.historyStore = HistorySources(historySourcePaths())
+            self.historyStore.skipToEnd()
+            entries = daemonHistory()
+            if entries is not None:
+                self.historyIndex.extendCounted(entries)
+            else:
+                self.historyStore = HistorySources(historySourcePaths())
+                self.historyStore.load(self.historyIndex.extend)
+                for path, error in self.historyStore.errors.items():
+                    self.debug = f"History not loaded from {path}: {error!r}"
+            # recent commands from fc are newer than the ones already saved to the file
+            self.historyIndex.extend(getRecentHistory())
+            self.directoryLog.refresh()
+        except Exception as error:
+            self.historyError = error
+            self.debug = f"History not loaded: {error!r}"
+        finally:
+            self.isHistoryLoading = False
+            PROFILE.end("history load")
+
+    def getHistory(self):
+        # The store is loaded once and tailed afterwards, so this is a stat call unless the file changed
+        if self.isHistoryLoading == False and self.historyStore is not None:
+            commands = self.historyStore.refresh()
+            if commands is None:
+                # a file was rewritten (zsh saves through a rename), extending would count its commands twice
+                self.historyStore = None
+                self.historyIndex.reset()
+                self.startHistoryLoader()
+            else:
+                self.historyIndex.extend(commands)
+        if self.isHistoryLoading == False:
+            self.directoryLog.refresh()
+        return self.historyIndex.commands()
  
     def execCommandIfAvailable(self):
         
@@ -477,72 +769,1624 @@ class ReCP:
         self.commandToExecute = None
         self.c = -1
 
+        # the wrapper function reads the command back and runs it in the calling shell
+        if self.outputPath is not None:
+            with open(self.outputPath, 'w') as file:
+                file.write(command)
+            return
+
         log(command)
+        import subprocess
         subprocess.run(command, shell = True)
         
     
 
 #
-# Config
+# History
 #
 
-class Config:
+HISTORY_CACHE_VERSION = 2
+HISTORY_FINGERPRINT_SIZE = 64
+HISTORY_READ_SIZE = 1 << 20
+
+# Tails a history file, parsing only the bytes appended since the last refresh.
+# The parsed records are cached on disk so the next launch only parses what the shell appended in between
+class HistoryStore:
+    def __init__(self, path):
+        self.path = path
+        self.format = historyFormat(path)
+        # the records not handed over by load yet, oldest first, one column per field
+        self.commands = CompactStrings()
+        self.timestamps = array('q')
+        self.durations = array('q')
+        self.offset = 0
+        self.inode = None
+        self.size = -1
+        self.mtime = -1
+        self.isReplaced = False # the file started over after it was read, the records read before are not in it anymore
+
+    # Returns the commands of all the records in the file, oldest first.
+    # onCommands is called with the UTF-8 encoded commands of each batch as it is read.
+    # The records are only kept until they are cached, afterwards the store only follows the end of the file
+    def load(self, onCommands = None):
+        return self.loadColumns(onCommands)[0]
+
+    # Same as load, returns the commands and their timestamps
+    def loadColumns(self, onCommands = None):
+        isCached = self.loadCache()
+        if onCommands is not None and len(self.commands) > 0:
+            onCommands(self.commands.encodedItems())
+        # the cache is only written again when the file had more to parse
+        if self.update(onCommands) is not None or isCached == False:
+            self.saveCache()
+        columns = (self.commands, self.timestamps)
+        self.commands = CompactStrings()
+        self.timestamps = array('q')
+        self.durations = array('q')
+        return columns
+
+    # Makes refresh start with the records appended from now on, for a file read by someone else
+    def skipToEnd(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return
+        self.offset = self.size = stat.st_size
+        self.inode = stat.st_ino
+        self.mtime = stat.st_mtime_ns
+
+    # Returns the UTF-8 encoded commands of the records added since the previous refresh, oldest first,
+    # or None when the file was replaced: its commands were already handed over and have to be loaded again
+    def refresh(self, onCommands = None):
+        start = self.update(onCommands)
+        if self.isReplaced:
+            return None
+        if start is None:
+            return []
+        return self.commands.encodedItems(start)
+
+    # Parses the records appended to the file, returns the index of the first new one in the columns,
+    # or None when the file did not change
+    def update(self, onCommands = None):
+        start = None
+        for blockStart in self.updatedBlocks():
+            if start is None:
+                start = blockStart
+            if onCommands is not None and len(self.commands) > blockStart:
+                onCommands(list(self.commands.encodedItems(blockStart)))
+        return start
+
+    # Same as loadColumns, yields the (timestamp, encoded command) records instead: the cached ones, then the ones
+    # of each block as it is parsed, so several files can be merged while they are read.
+    # A command without a timestamp gets the one of the command before it, like in timestampedCommands
+    def loadRecords(self):
+        isCached = self.loadCache()
+        isUpdated = False
+        latest = 0
+        start = 0
+        blocks = self.updatedBlocks()
+        while True:
+            for timestamp, command in zip(itertools.islice(self.timestamps, start, None), self.commands.encodedItems(start)):
+                latest = max(latest, timestamp)
+                yield (latest, command)
+            start = next(blocks, None)
+            if start is None:
+                break
+            isUpdated = True
+
+        if isUpdated or isCached == False:
+            self.saveCache()
+        self.commands = CompactStrings()
+        self.timestamps = array('q')
+        self.durations = array('q')
+
+    # Parses the records appended to the file one block at a time. Yields the index in the columns of the first record
+    # of each block once it is parsed, and nothing when the file did not change
+    def updatedBlocks(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return
+
+        if stat.st_ino == self.inode and stat.st_size == self.size and stat.st_mtime_ns == self.mtime:
+            return
+
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            # the file was replaced or truncated (e.g. HISTSIZE rotation, or zsh saving through a rename), start over
+            self.isReplaced = self.inode is not None
+            self.commands = CompactStrings()
+            self.timestamps = array('q')
+            self.durations = array('q')
+            self.offset = 0
+
+        with open(self.path, 'rb') as file:
+            file.seek(self.offset)
+            pending = b''
+            while True:
+                block = file.read(HISTORY_READ_SIZE)
+                isFinal = len(block) == 0
+                data = pending + block
+                # a partial record at the end is carried to the next block, or to the next refresh
+                records, consumed = parseHistory(data, self.format, isFinal)
+                pending = data[consumed:]
+                self.offset += consumed
+                start = len(self.commands)
+                if len(records) > 0:
+                    timestamps, durations, commands = zip(*records)
+                    self.timestamps.extend(timestamps)
+                    self.durations.extend(durations)
+                    self.commands.extend([ command.encode('utf-8', errors='replace') for command in commands ])
+                if isFinal:
+                    # before the last block is handed over, a caller may not ask for the rest
+                    self.inode = stat.st_ino
+                    self.size = stat.st_size
+                    self.mtime = stat.st_mtime_ns
+                    yield start
+                    return
+                yield start
+
+    def cachePath(self):
+        return os.path.join(cacheDirectory(), f"history-{pathDigest(self.path)}")
+
+    def fingerprint(self, offset):
+        with open(self.path, 'rb') as file:
+            file.seek(max(0, offset - HISTORY_FINGERPRINT_SIZE))
+            return file.read(min(offset, HISTORY_FINGERPRINT_SIZE))
+
+    # Returns whether the cache was loaded
+    def loadCache(self):
+        try:
+            with open(self.cachePath(), 'rb') as file:
+                cache = marshal.load(file)
+            stat = os.stat(self.path)
+        except (OSError, EOFError, ValueError, TypeError):
+            return False
+
+        if cache.get('version') != HISTORY_CACHE_VERSION or cache['inode'] != stat.st_ino or cache['offset'] > stat.st_size:
+            return False
+        isUnchanged = cache['size'] == stat.st_size and cache['mtime'] == stat.st_mtime_ns
+        # an appended file still starts with the bytes that were parsed last time
+        if not isUnchanged and self.fingerprint(cache['offset']) != cache['fingerprint']:
+            return False
+
+        self.commands = CompactStrings.loaded(cache['commands'])
+        self.timestamps = arrayFromBytes('q', cache['timestamps'])
+        self.durations = arrayFromBytes('q', cache['durations'])
+        self.offset = cache['offset']
+        self.inode = cache['inode']
+        if isUnchanged:
+            self.size = cache['size']
+            self.mtime = cache['mtime']
+        return True
+
+    def saveCache(self):
+        if self.inode is None:
+            return
+        cache = {
+            'version': HISTORY_CACHE_VERSION,
+            'inode': self.inode,
+            'size': self.size,
+            'mtime': self.mtime,
+            'offset': self.offset,
+            'fingerprint': self.fingerprint(self.offset),
+            'commands': self.commands.dumped(),
+            'timestamps': self.timestamps.tobytes(),
+            'durations': self.durations.tobytes()
+        }
+        try:
+            os.makedirs(cacheDirectory(), exist_ok=True)
+            tempPath = f"{self.cachePath()}.{os.getpid()}"
+            with open(tempPath, 'wb') as file:
+                marshal.dump(cache, file)
+            os.replace(tempPath, self.cachePath())
+        except OSError:
+            pass
+
+
+# The history files of the shells, and the ones synced from other hosts, read as a single history.
+# The commands of every file are merged by timestamp as they are read, and a file that cannot be read
+# or parsed is left out without affecting the others
+class HistorySources:
+    def __init__(self, paths):
+        self.stores = list(map(HistoryStore, paths))
+        self.errors = {} # path -> error of the last read that failed
+
+    # Same as HistoryStore.load, with the commands of all the files oldest first
+    def load(self, onCommands = None):
+        if len(self.stores) == 1:
+            # nothing to merge, the commands are handed over as they are parsed
+            return self.read(self.stores[0], lambda store: store.load(onCommands), CompactStrings())
+
+        # every file is parsed block by block as the merge needs its next records
+        merged = CompactStrings()
+        records = heapq.merge(*map(self.records, self.stores))
+        while True:
+            batch = list(map(lambda record: record[1], itertools.islice(records, HISTORY_BATCH_SIZE)))
+            if len(batch) == 0:
+                return merged
+            merged.extend(batch)
+            if onCommands is not None:
+                onCommands(batch)
+
+    def skipToEnd(self):
+        for store in self.stores:
+            store.skipToEnd()
+
+    # Same as HistoryStore.refresh, with the commands appended to any of the files.
+    # Returns None when any of them was replaced, the history is then loaded again with new HistorySources
+    def refresh(self):
+        streams = []
+        for store in self.stores:
+            start = self.read(store, HistoryStore.update, None)
+            if store.isReplaced:
+                return None
+            if start is not None:
+                streams.append(timestampedCommands(store.commands, store.timestamps, start))
+        if len(streams) == 0:
+            return []
+        return list(map(lambda record: record[1], heapq.merge(*streams)))
+
+    # The records of a store as it is read, cut short when it cannot be read or parsed
+    def records(self, store):
+        try:
+            yield from store.loadRecords()
+            self.errors.pop(store.path, None)
+        except Exception as error:
+            self.errors[store.path] = error
+
+    def read(self, store, method, fallback):
+        try:
+            result = method(store)
+            self.errors.pop(store.path, None)
+            return result
+        except Exception as error:
+            self.errors[store.path] = error
+            return fallback
+
+# (timestamp, encoded command) records from the start index of the columns. Commands without a timestamp
+# (bash without HISTTIMEFORMAT) get the one of the command before them, which keeps them in their place in the merge
+def timestampedCommands(commands, timestamps, start = 0):
+    return zip(itertools.accumulate(itertools.islice(timestamps, start, None), max), commands.encodedItems(start))
+
+
+def historyFormat(path):
+    name = os.path.basename(path)
+    if name.endswith("fish_history"):
+        return "fish"
+    elif "zsh" in name:
+        return "zsh"
+    return "bash"
+
+# Parses the content of a history file into (timestamp, duration, command) records.
+# Returns the records and the number of bytes consumed, which excludes a trailing incomplete record.
+# isFinal tells that no more data follows, so a record without an explicit end is complete
+def parseHistory(data, format, isFinal = True):
+    if format == "fish":
+        return parseFishHistory(data, isFinal)
+    elif format == "zsh":
+        return parseZshHistory(data)
+    return parseBashHistory(data)
+
+ZSH_EXTENDED_PREFIX = re.compile(r": *(\d+):(\d+);")
+
+def parseZshHistory(data):
+    records = []
+    consumed = 0
+    entry = []
+    position = 0
+    end = data.rfind(b'\n') + 1
+    for line in data[:end].split(b'\n')[:-1]:
+        position += len(line) + 1
+        # multi-line commands are saved with a backslash before each newline
+        if line.endswith(b'\\'):
+            entry.append(line[:-1])
+            continue
+        entry.append(line)
+        text = unmetafied(b'\n'.join(entry)).decode('utf-8', errors='replace')
+        entry = []
+        consumed = position
+
+        match = ZSH_EXTENDED_PREFIX.match(text)
+        if match:
+            records.append((int(match.group(1)), int(match.group(2)), text[match.end():]))
+        else:
+            records.append((0, 0, text))
+    return records, consumed
+
+# zsh escapes some bytes in the history file as 0x83 followed by the byte xor 32
+def unmetafied(data):
+    if b'\x83' not in data:
+        return data
+    result = bytearray()
+    index = 0
+    while index < len(data):
+        byte = data[index]
+        if byte == 0x83 and index + 1 < len(data):
+            index += 1
+            byte = data[index] ^ 32
+        result.append(byte)
+        index += 1
+    return bytes(result)
+
+BASH_TIMESTAMP = re.compile(r"#(\d+)$")
+
+def parseBashHistory(data):
+    records = []
+    consumed = 0
+    timestamp = 0
+    position = 0
+    end = data.rfind(b'\n') + 1
+    for line in data[:end].split(b'\n')[:-1]:
+        position += len(line) + 1
+        text = line.decode('utf-8', errors='replace')
+        # with HISTTIMEFORMAT set, bash writes a #<epoch> line before each command
+        match = BASH_TIMESTAMP.match(text)
+        if match:
+            timestamp = int(match.group(1))
+            continue
+        records.append((timestamp, 0, text))
+        timestamp = 0
+        consumed = position
+    return records, consumed
+
+def parseFishHistory(data, isFinal):
+    records = []
+    consumed = 0
+    record = None
+    position = 0
+    end = data.rfind(b'\n') + 1
+    for line in data[:end].split(b'\n')[:-1]:
+        lineStart = position
+        position += len(line) + 1
+        text = line.decode('utf-8', errors='replace')
+        if text.startswith("- cmd: "):
+            if record is not None:
+                records.append(tuple(record))
+                consumed = lineStart
+            record = [0, 0, unescapedFishCommand(text[7:])]
+        elif record is not None and text.startswith("  when: "):
+            try:
+                record[0] = int(text[8:])
+            except ValueError:
+                pass
+
+    # fish writes each entry at once, the last one is complete when the data ends on a newline
+    if record is not None and isFinal:
+        records.append(tuple(record))
+        consumed = end
+    return records, consumed
+
+def unescapedFishCommand(command):
+    return re.sub(r"\\(.)", lambda match: "\n" if match.group(1) == "n" else match.group(1), command)
+
+def cacheDirectory():
+    return os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser('~'), ".cache")), "recp")
+
+def pathDigest(path):
+    import hashlib
+    return hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]
+
+def dataDirectory():
+    return os.path.join(os.environ.get("XDG_DATA_HOME", os.path.join(os.path.expanduser('~'), ".local", "share")), "recp")
+
+
+#
+# Usage
+#
+
+FRECENCY_HALF_LIFE_SECONDS = 7 * 24 * 60 * 60
+
+# Append-only log of the commands run or copied from ReCP, one JSON object per line.
+# Each command keeps a score that halves every FRECENCY_HALF_LIFE_SECONDS and grows by one on every use,
+# so recording a use and looking up a score are both O(1)
+class UsageLog:
+    def __init__(self, path):
+        self.path = path
+        self.scores = {} # command -> (score at the last use, time of the last use)
+        self.version = 0
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                        self.update(entry['command'], entry['time'])
+                    except (ValueError, KeyError):
+                        # skip a line cut short by a crash
+                        continue
+        except OSError:
+            pass
+
+    def record(self, command, action):
+        command = normalizedCommand(command)
+        entry = {
+            'time': time.time(),
+            'action': action,
+            'cwd': os.getcwd(),
+            'command': command
+        }
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(entry) + "\n")
+        except OSError as error:
+            log(f"Usage not recorded: {error}")
+        self.update(command, entry['time'])
+
+    def update(self, command, timestamp):
+        score, lastTime = self.scores.get(command, (0, timestamp))
+        self.scores[command] = (score * decay(timestamp - lastTime) + 1, timestamp)
+        self.version += 1
+
+    def frecency(self, command, now = None):
+        if command not in self.scores:
+            return 0
+        score, lastTime = self.scores[command]
+        return score * decay((now or time.time()) - lastTime)
+
+    # Comparable across commands without knowing the current time: log2 of the score decayed to time 0
+    def rank(self, command):
+        score, lastTime = self.scores[command]
+        return math.log2(score) + lastTime / FRECENCY_HALF_LIFE_SECONDS
+
+    # Commands used from ReCP first, by frecency, then the others in their original order
+    def ranked(self, items, commandForItem):
+        used = []
+        unused = []
+        for item in items:
+            command = normalizedCommand(commandForItem(item))
+            (used if command in self.scores else unused).append(item)
+        used.sort(key=lambda item: self.rank(normalizedCommand(commandForItem(item))), reverse=True)
+        return used + unused
+
+    # Same as ranked for the commands of a HistoryIndex, looking up the used commands instead of decoding every entry
+    def rankedView(self, view, historyIndex):
+        used = []
+        for command in self.scores:
+            id = historyIndex.idOf(command)
+            if id is not None:
+                used.append((self.rank(command), id))
+        used.sort(reverse=True)
+        return viewWithIdsFirst(view, list(map(lambda x: x[1], used)))
+
+
+def decay(elapsed):
+    return 2 ** (-max(elapsed, 0) / FRECENCY_HALF_LIFE_SECONDS)
+
+
+# Strings kept end to end in a single UTF-8 buffer, with an array of the offsets where each one starts.
+# An entry is decoded only when it is read, so a million commands take a few tens of bytes each instead of
+# a Python object per command. Each entry is followed by a newline, for a MULTILINE ^ to anchor at its start.
+# The offsets are 32 bit, which limits the buffer to 4 GiB
+class CompactStrings:
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offsets = array('I', [0]) # entry i is buffer[offsets[i]:offsets[i + 1] - 1]
+
+    @classmethod
+    def loaded(cls, dumped):
+        strings = cls()
+        strings.buffer = bytearray(dumped[0])
+        strings.offsets = arrayFromBytes('I', dumped[1])
+        return strings
+
+    def dumped(self):
+        return (bytes(self.buffer), self.offsets.tobytes())
+
+    def append(self, data):
+        self.buffer += data
+        self.buffer.append(10)
+        self.offsets.append(len(self.buffer))
+
+    def extend(self, datas):
+        if len(datas) == 0:
+            return
+        ends = itertools.accumulate(map(lambda data: len(data) + 1, datas), initial = len(self.buffer))
+        self.buffer += b"\n".join(datas)
+        self.buffer.append(10)
+        self.offsets.extend(itertools.islice(ends, 1, None))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, id):
+        return str(self.encoded(id), 'utf-8', 'replace')
+
+    def encoded(self, id):
+        return self.buffer[self.offsets[id]:self.offsets[id + 1] - 1]
+
+    def encodedItems(self, start = 0):
+        for id in range(start, len(self)):
+            yield self.encoded(id)
+
+    def matchesEntry(self, pattern, id, isAnchored):
+        start = self.offsets[id]
+        end = self.offsets[id + 1] - 1
+        return (pattern.match if isAnchored else pattern.search)(self.buffer, start, end) is not None
+
+    # Returns an array of the given ids with a match, in their order. Same as matchesEntry on each id, inlined
+    def matchingEntries(self, pattern, ids, isAnchored):
+        offsets = self.offsets
+        buffer = self.buffer
+        match = pattern.match if isAnchored else pattern.search
+        return array('I', [ id for id in ids if match(buffer, offsets[id], offsets[id + 1] - 1) is not None ])
+
+    # Returns the set of ids from first to last with a match, scanning the buffer instead of each entry.
+    # With isAnchored the match has to start where the entry starts, like re.match
+    def matchingIds(self, pattern, isAnchored, first = 0, last = None):
+        ids = set()
+        limit = self.offsets[len(self) if last is None else last]
+        match = pattern.search(self.buffer, self.offsets[first], limit)
+        while match is not None:
+            id = bisect.bisect_right(self.offsets, match.start()) - 1
+            start = self.offsets[id]
+            end = self.offsets[id + 1] - 1
+            if match.end() > end:
+                # the match ran into the next entry, try again within this one
+                if self.matchesEntry(pattern, id, isAnchored):
+                    ids.add(id)
+            elif isAnchored == False or match.start() == start:
+                ids.add(id)
+            # one match per entry is enough
+            match = pattern.search(self.buffer, end + 1, limit)
+        return ids
+
+
+# Read-only sequence of some entries of a CompactStrings, in the order of an array of their ids
+class CompactView:
+    def __init__(self, strings, ids):
+        self.strings = strings
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(map(self.strings.__getitem__, self.ids[index]))
+        return self.strings[self.ids[index]]
+
+
+# The entries with the ids first, in the order of the ids, then the other ones in the order of the view
+def viewWithIdsFirst(view, ids):
+    if len(ids) == 0:
+        return view
+    firstIds = set(ids)
+    ids = array('I', ids)
+    ids.extend(itertools.filterfalse(firstIds.__contains__, view.ids))
+    return CompactView(view.strings, ids)
+
+
+# Read-only sequence of the commands of a list of recipes
+class RecipeCommands:
+    def __init__(self, recipes):
+        self.recipes = recipes
+
+    def __len__(self):
+        return len(self.recipes)
+
+    def __getitem__(self, index):
+        return self.recipes[index]['recipe']
+
+
+def arrayFromBytes(typecode, data):
+    result = array(typecode)
+    result.frombytes(data)
+    return result
+
+
+HISTORY_TABLE_EMPTY = -1
+HISTORY_BATCH_SIZE = 8192
+
+# Unique commands, most recent first. Each command gets an id in a CompactStrings and the ids are found through
+# an open addressing hash table kept in an array, so adding a command is O(1) without a Python object per command
+class HistoryIndex:
     def __init__(self):
-        dictionary = self.getConfig()
+        self.strings = CompactStrings() # id -> command, in the order the commands were first added
+        self.hashes = array('q') # id -> hash of the encoded command
+        self.counts = array('I') # id -> number of runs
+        self.sequences = array('I') # id -> sequence of the last run
+        self.table = array('i', [HISTORY_TABLE_EMPTY]) * 8 # slot -> id, kept at most half full
+        self.pendingRuns = array('I') # ids run since the order was last computed
+        self.ordered = CompactView(self.strings, array('I'))
+        self.orderedVersion = -1
+        self.version = 0 # bumped on every change, never goes back
+        self.runs = 0 # number of runs added since the last reset, the scale of the sequences
+        self.lock = threading.Lock() # commands can be added from the loading thread while the UI reads them
+
+    # Empties the index, to load the history again when a file was replaced. The version keeps growing
+    # so nothing computed from the previous content is taken for current
+    def reset(self):
+        with self.lock:
+            self.strings = CompactStrings()
+            self.hashes = array('q')
+            self.counts = array('I')
+            self.sequences = array('I')
+            self.table = array('i', [HISTORY_TABLE_EMPTY]) * 8
+            self.pendingRuns = array('I')
+            self.ordered = CompactView(self.strings, array('I'))
+            self.runs = 0
+            self.version += 1
+
+    def extend(self, commands):
+        commands = iter(commands)
+        while True:
+            chunk = list(itertools.islice(commands, HISTORY_BATCH_SIZE))
+            if len(chunk) == 0:
+                break
+            # the runs of a command within a batch are merged in a dict before they reach the arrays
+            batch = {}
+            for command in chunk:
+                data = encodedCommand(command)
+                if len(data) > 0:
+                    batch[data] = batch.pop(data, 0) + 1
+            with self.lock:
+                for data, runs in batch.items():
+                    id = self.run(data, runs)
+                    self.counts[id] += runs
+
+    # Adds (command, count) entries, oldest first, from an index that was already built elsewhere
+    def extendCounted(self, entries):
+        with self.lock:
+            for command, count in entries:
+                data = encodedCommand(command)
+                if len(data) > 0:
+                    id = self.run(data, 1)
+                    self.counts[id] = count
+
+    # Records the last of runs runs of the encoded command as the most recent one, returns its id
+    def run(self, data, runs):
+        self.version += runs
+        self.runs += runs
+        hashValue = hash(data)
+        slot = self.slotFor(data, hashValue)
+        id = self.table[slot]
+        if id == HISTORY_TABLE_EMPTY:
+            id = len(self.hashes)
+            self.strings.append(data)
+            self.hashes.append(hashValue)
+            self.counts.append(0)
+            self.sequences.append(0)
+            self.table[slot] = id
+            if len(self.hashes) * 2 > len(self.table):
+                self.resize()
+        self.sequences[id] = self.runs
+        self.pendingRuns.append(id)
+        return id
+
+    # The slot holding the command, or the empty slot where it would go
+    def slotFor(self, data, hashValue):
+        table = self.table
+        mask = len(table) - 1
+        slot = hashValue & mask
+        while True:
+            id = table[slot]
+            if id == HISTORY_TABLE_EMPTY or (self.hashes[id] == hashValue and self.strings.encoded(id) == data):
+                return slot
+            slot = (slot + 1) & mask
+
+    def resize(self):
+        table = array('i', [HISTORY_TABLE_EMPTY]) * (len(self.table) * 2)
+        mask = len(table) - 1
+        for id, hashValue in enumerate(self.hashes):
+            slot = hashValue & mask
+            while table[slot] != HISTORY_TABLE_EMPTY:
+                slot = (slot + 1) & mask
+            table[slot] = id
+        # swapped at once, the UI thread may be looking a command up
+        self.table = table
+
+    def idOf(self, command):
+        data = encodedCommand(command)
+        id = self.table[self.slotFor(data, hash(data))]
+        return None if id == HISTORY_TABLE_EMPTY else id
+
+    def count(self, command):
+        id = self.idOf(command)
+        return 0 if id is None else self.counts[id]
+
+    # A CompactView, most recent first
+    def commands(self):
+        with self.lock:
+            if self.orderedVersion != self.version:
+                # the commands run since the last time go first, and leave their previous place
+                recent = array('I')
+                isRecent = set()
+                for id in reversed(self.pendingRuns):
+                    if id not in isRecent:
+                        isRecent.add(id)
+                        recent.append(id)
+                recent.extend(itertools.filterfalse(isRecent.__contains__, self.ordered.ids))
+                self.pendingRuns = array('I')
+                self.ordered = CompactView(self.strings, recent)
+                self.orderedVersion = self.version
+            return self.ordered
+
+    # (encoded command, count) entries oldest first, the order extendCounted expects
+    def countedEntries(self):
+        ids = self.commands().ids
+        return map(lambda id: (self.strings.encoded(id), self.counts[id]), reversed(ids))
+
+    def __len__(self):
+        return len(self.hashes)
+
+
+def normalizedCommand(command):
+    return command.strip()
+
+def encodedCommand(command):
+    if isinstance(command, str):
+        return normalizedCommand(command).encode('utf-8', errors='replace')
+    return bytes(command.strip())
+
+
+# The history file of each shell, by the name of its executable
+def shellHistoryPath(shell):
+    home = os.path.expanduser('~')
+    if shell == "fish":
+        return os.path.join(os.environ.get("XDG_DATA_HOME", os.path.join(home, ".local", "share")), "fish", "fish_history")
+    elif shell == "zsh":
+        return os.path.join(home, ".zsh_history")
+    elif shell == "bash":
+        return os.path.join(home, ".bash_history")
+    return None
+
+# The history file of the shell running ReCP, e.g. /usr/bin/zsh, /opt/homebrew/bin/bash or fish. Defaults to bash
+def historyFilePath():
+    return shellHistoryPath(os.path.basename(os.environ.get("SHELL", ""))) or shellHistoryPath("bash")
+
+# The history of the current shell, the histories of the other shells found, then the files synced from other hosts
+# to ~/.local/share/recp/hosts, e.g. work.zsh_history or laptop.fish_history. The format comes from the file name
+def historySourcePaths():
+    paths = [ historyFilePath() ]
+    for shell in ["zsh", "bash", "fish"]:
+        paths.append(shellHistoryPath(shell))
+    hostsDirectory = os.path.join(dataDirectory(), "hosts")
+    try:
+        paths.extend(map(lambda name: os.path.join(hostsDirectory, name), sorted(os.listdir(hostsDirectory))))
+    except OSError:
+        pass
+
+    # the current shell's file is always read, even before it exists
+    sources = [ paths[0] ]
+    for path in paths[1:]:
+        if os.path.isfile(path) and not any(map(lambda source: os.path.realpath(source) == os.path.realpath(path), sources)):
+            sources.append(path)
+    return sources
+
+def getRecentHistory():
+    # get list of recent executed commands
+    import subprocess
+    recent = subprocess.run("fc -l -250 | cut -c 8-", shell = True, capture_output = True, text = True)
+    return recent.stdout.split("\n")
+
+
+#
+# Directories
+#
 
-        if 'recipes' not in dictionary:
-            self.setup()
+DIRECTORY_LOG_NAME = "directories.log"
+
+# Append-only log of the commands run in the shells set up with --shell-init, written by their hooks as
+# timestamp<TAB>directory<TAB>command<NUL> records. Tailed like the history files, into a DirectoryIndex
+class DirectoryLog:
+    def __init__(self, path):
+        self.path = path
+        self.index = DirectoryIndex()
+        self.offset = 0
+        self.inode = None
+        self.size = -1
+
+    def refresh(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
             return
+        if stat.st_ino == self.inode and stat.st_size == self.size:
+            return
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            self.index = DirectoryIndex()
+            self.offset = 0
+
+        with open(self.path, 'rb') as file:
+            file.seek(self.offset)
+            data = file.read()
+        # a record still being written is read on the next refresh
+        end = data.rfind(b'\0') + 1
+        for record in data[:end].decode('utf-8', errors='replace').split("\0")[:-1]:
+            fields = record.split("\t", 2)
+            if len(fields) == 3 and fields[0].isdigit():
+                self.index.add(fields[1], fields[2])
+        self.offset += end
+        self.inode = stat.st_ino
+        self.size = stat.st_size
+
+# Commands by the directory they were run in. The directories are kept sorted with a trailing /, so the ones
+# below a directory share its prefix and are a contiguous range found with two bisections
+class DirectoryIndex:
+    def __init__(self):
+        self.directories = [] # sorted
+        self.commands = {} # directory -> { command: version of the last run }
+        self.version = 0
+
+    # The log is written as the commands run, so the order of the records is the order of the runs
+    def add(self, directory, command):
+        command = normalizedCommand(command)
+        if len(command) == 0:
+            return
+        key = directoryKey(directory)
+        commands = self.commands.get(key)
+        if commands is None:
+            commands = self.commands[key] = {}
+            bisect.insort(self.directories, key)
+        self.version += 1
+        commands[command] = self.version
+
+    # The commands run in the directory or below it, most recent first
+    def commandsUnder(self, directory):
+        key = directoryKey(directory)
+        start = bisect.bisect_left(self.directories, key)
+        # '0' follows '/', every path below the directory sorts before the directory followed by '0'
+        end = bisect.bisect_left(self.directories, key[:-1] + "0", start)
+        latest = {}
+        for path in self.directories[start:end]:
+            for command, version in self.commands[path].items():
+                if version > latest.get(command, 0):
+                    latest[command] = version
+        return sorted(latest, key=latest.__getitem__, reverse=True)
+
+def directoryKey(directory):
+    return directory.rstrip("/") + "/"
 
-        self.recipes = dictionary['recipes']
-        self.source = dictionary['source']
 
-    def getConfig(self):
-        filePath = self.getFilePath()
-        if filePath is None:
-            return { }
-        
-        file = open(filePath, 'r')
-        jsonStr = file.read()
-        name = file.name
-        if jsonStr == "":
-            # there is a file, but it is not initialized.
-            log(f"Initializing empty config file: {name}")
-            config = { "recipes": [], "source": "" }
+#
+# Clipboard
+#
+
+# Copies text with the first clipboard tool found, detected on the first copy and kept for the session.
+# The text is piped to the tool directly, without a shell. Over ssh, or when no tool is found,
+# it is sent to the terminal as an OSC 52 sequence, which the terminal puts on the local clipboard.
+class Clipboard:
+    def __init__(self):
+        self.backend = None # (name, arguments), arguments is None for OSC 52
+
+    def detectedBackend(self):
+        import shutil
+        isRemote = "SSH_CONNECTION" in os.environ or "SSH_TTY" in os.environ
+        if sys.platform == "darwin" and isRemote == False and shutil.which("pbcopy"):
+            return ("pbcopy", ["pbcopy"])
+        if os.environ.get("WAYLAND_DISPLAY") and shutil.which("wl-copy"):
+            return ("wl-copy", ["wl-copy"])
+        if os.environ.get("DISPLAY"):
+            if shutil.which("xclip"):
+                return ("xclip", ["xclip", "-selection", "clipboard"])
+            if shutil.which("xsel"):
+                return ("xsel", ["xsel", "--clipboard", "--input"])
+        return ("OSC 52", None)
+
+    # Returns the name of the backend that was used
+    def copy(self, text):
+        if self.backend is None:
+            self.backend = self.detectedBackend()
+
+        name, arguments = self.backend
+        data = text.encode()
+        if arguments is not None:
+            import subprocess
+            try:
+                # xclip and wl-copy keep serving the selection from a background child, so nothing is read back
+                subprocess.run(arguments, input = data, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL, check = True, timeout = 2)
+                return name
+            except (OSError, subprocess.SubprocessError):
+                # the tool is missing or cannot reach the display, fall back for the rest of the session
+                self.backend = ("OSC 52", None)
+
+        # curses writes to stdout as well, the sequence does not move the cursor so the screen is left as it is
+        sys.stdout.flush()
+        os.write(sys.stdout.fileno(), osc52Sequence(data))
+        return "OSC 52"
+
+def osc52Sequence(data):
+    import base64
+    sequence = b"\033]52;c;" + base64.b64encode(data) + b"\a"
+    if "TMUX" in os.environ:
+        # tmux forwards the sequence to the outer terminal only inside a passthrough, with every ESC doubled
+        return b"\033Ptmux;" + sequence.replace(b"\033", b"\033\033") + b"\033\\"
+    if "STY" in os.environ:
+        return b"\033P" + sequence + b"\033\\"
+    return sequence
+
+
+#
+# Rendering
+#
+
+# A bordered window kept across frames. Only the title and the rows that changed since the previous frame are redrawn,
+# and nothing is sent to the terminal until curses.doupdate
+class Pane:
+    def __init__(self, x, y, width, height):
+        self.box = curses.newwin(height, width, y, x) # height, width, y, x
+        self.window = curses.newwin(height-2, width-2, y+1, x+1)
+        self.width = width
+        self.height = height
+        self.title = None
+        self.rows = []
+
+    def setTitle(self, title, style):
+        if self.title == (title, style):
+            return
+        self.title = (title, style)
+        self.box.erase()
+        self.box.box()
+        self.box.addstr(0, 3, title, curses.color_pair(style))
+        # the erased box is copied over the rows, which have to be copied again on top of it
+        self.window.touchwin()
+
+    # Each row is a list of (text, style) segments
+    def setRows(self, rows):
+        for i in range(len(rows)):
+            if i < len(self.rows) and self.rows[i] == rows[i]:
+                continue
+            self.window.move(i, 0)
+            self.window.clrtoeol()
+            for text, style in rows[i]:
+                try:
+                    self.window.addstr(text, curses.color_pair(style))
+                except curses.error:
+                    # the text reached the bottom right corner, curses could not move the cursor past it
+                    pass
+
+        for i in range(len(rows), len(self.rows)):
+            self.window.move(i, 0)
+            self.window.clrtoeol()
+        self.rows = rows
+
+    # Mark the whole pane to be copied again on the next refresh
+    def invalidate(self):
+        self.box.touchwin()
+        self.window.touchwin()
+
+    def noutrefresh(self):
+        self.box.noutrefresh()
+        self.window.noutrefresh()
+
+
+# Scroll state of a list that can be longer than its pane. Only the rows inside the viewport are rendered,
+# so the cost of a frame depends on the pane height and not on the number of items
+class ListView:
+    def __init__(self):
+        self.items = None
+        self.offset = 0
+        self.height = 0
+
+    # Returns the range of item indexes to render, scrolled to keep the selection visible
+    def visibleRange(self, items, height, selection):
+        if items is not self.items and selection < 0:
+            # new results, e.g. after the search changed, start from the top
+            self.offset = 0
+        self.items = items
+        self.height = max(height, 1)
+
+        if selection >= 0:
+            if selection < self.offset:
+                self.offset = selection
+            elif selection >= self.offset + self.height:
+                self.offset = selection - self.height + 1
+        self.offset = max(0, min(self.offset, len(items) - self.height))
+        return range(self.offset, min(self.offset + self.height, len(items)))
+
+
+ROW_LAYOUT_CACHE_ENTRIES = 4096
+
+# The display strings of the rows of a pane, laid out once per entry instead of on every frame.
+# Entries are found by their identity (a history id, or the id of a recipe dict of the current config version)
+# and the width of their [index] prefix. Everything is laid out again when the layout key changes,
+# i.e. the pane width, the info toggle or the data
+class RowLayoutCache:
+    def __init__(self):
+        self.key = None
+        self.rows = {}
+
+    # layout(entry) is called when the entry is not cached for this key
+    def row(self, key, entry, layout):
+        if key != self.key or len(self.rows) >= ROW_LAYOUT_CACHE_ENTRIES:
+            self.key = key
+            self.rows = {}
+        row = self.rows.get(entry)
+        if row is None:
+            row = self.rows[entry] = layout(entry)
+        return row
+
+
+#
+# Search
+#
+
+REGEX_SPECIAL_CHARACTERS = set(".^$*+?{}[]\\|()")
+
+# Filters (item, searchString) tuples by a query, caching compiled patterns and the results of every query typed so far.
+# Typing one more character narrows the previous results and backspace returns the cached ones
+class SearchFilter:
+    def __init__(self, parallelSearch = None):
+        self.parallelSearch = parallelSearch # scans large CompactViews in other processes
+        self.state = None
+        self.results = {} # query -> (matching tuples, matching items) for the current corpus version and mode
+        self.patterns = {}
+        self.bytesPatterns = {}
+        self.fuzzyIndex = None
+        self.candidates = None # (lowered query, ids) of the last fuzzy scan of a CompactView
+        self.initials = None # the first byte of each entry of a CompactView, in its order
+
+    def resetIfNeeded(self, state):
+        if state != self.state:
+            self.results = {}
+            self.candidates = None
+            self.initials = None
+            self.state = state
+
+    def filter(self, itemsSearchTuples, version, query):
+        self.resetIfNeeded((version, False))
+
+        if query not in self.results:
+            self.results[query] = self.search(itemsSearchTuples, query)
+            # only keep the chain of queries that leads to the current one
+            self.results = { key: value for key, value in self.results.items() if query.startswith(key) }
+        return self.results[query][1]
+
+    def search(self, itemsSearchTuples, query):
+        if len(query) == 0:
+            return (itemsSearchTuples, list(map(lambda x: x[0], itemsSearchTuples)))
+
+        # the matches for a literal query are a subset of the matches for its literal prefix
+        previous = query[:-1]
+        if isLiteralQuery(query) and isLiteralQuery(previous) and previous in self.results:
+            itemsSearchTuples = self.results[previous][0]
+
+        filtered = list(self.matchingTuples(itemsSearchTuples, query))
+        return (filtered, list(map(lambda x: x[0], filtered)))
+
+    # Yields the matching tuples one by one, so the first ones can be used before the whole corpus is scanned
+    def matchingTuples(self, itemsSearchTuples, query):
+        if len(query) == 0:
+            return iter(itemsSearchTuples)
+        pattern = self.compiledPattern(query)
+        if pattern is not None:
+            return (s for s in itemsSearchTuples if pattern.match(s[1]))
+        return filter(lambda tuple: query in tuple[1], itemsSearchTuples)
+
+    def matches(self, itemsSearchTuples, query):
+        return map(lambda x: x[0], self.matchingTuples(itemsSearchTuples, query))
+
+    def fuzzyFilter(self, itemsSearchTuples, version, query, limit, bonus):
+        self.resetIfNeeded((version, True, limit))
+        if len(query) == 0:
+            return self.filter(itemsSearchTuples, version, query)
+
+        if query not in self.results:
+            # the index is only built the first time fuzzy search is used, then kept in sync with the corpus
+            if self.fuzzyIndex is None:
+                self.fuzzyIndex = FuzzyIndex()
+            if self.fuzzyIndex.version != version:
+                self.fuzzyIndex.update(itemsSearchTuples, version)
+            self.results = { query: (None, self.fuzzyIndex.search(query, limit, bonus)) }
+        return self.results[query][1]
+
+    # Same as filter for a CompactView, the pattern runs on the UTF-8 bytes so only the matches are ever decoded.
+    # Case is ignored for ASCII letters only. Returns None while the search processes are still running
+    def filterView(self, view, version, query):
+        self.resetIfNeeded((version, False))
+
+        if query not in self.results:
+            results = self.searchView(view, query)
+            if results is None:
+                return None
+            self.results[query] = results
+            self.results = { key: value for key, value in self.results.items() if query.startswith(key) }
+        return self.results[query]
+
+    def searchView(self, view, query):
+        if len(query) == 0:
+            self.cancelParallelSearch()
+            return view
+
+        pattern, isAnchored = self.compiledBytesPattern(query)
+        previous = query[:-1]
+        candidates = None
+        if isLiteralQuery(query):
+            # the matches of a literal query are among the matches of its literal prefix, and start with its first character
+            if len(previous) > 0 and isLiteralQuery(previous) and previous in self.results:
+                candidates = self.results[previous].ids
+            else:
+                candidates = self.idsStartingWith(view, query)
+
+        isFirstByte = len(query.encode()) == 1
+        if candidates is not None and (isFirstByte or len(candidates) * COMPACT_SCAN_RATIO < len(view)):
+            # few candidates are left, matching them one by one beats scanning the buffer
+            self.cancelParallelSearch()
+            ids = candidates if isFirstByte else view.strings.matchingEntries(pattern, candidates, isAnchored)
         else:
-            print(f"Found config file: {name}")
-            config = json.loads(jsonStr)
-            
-        if 'recipes' in config:
-            config['source'] = file.name
-        return config
+            matchingIds = self.inParallel(view, lambda search: search.matchingIds(pattern, isAnchored), lambda: view.strings.matchingIds(pattern, isAnchored))
+            if matchingIds is None:
+                return None
+            ids = filter(matchingIds.__contains__, view.ids)
+        return CompactView(view.strings, array('I', ids))
+
+    # The ids of the view whose entry starts with the first byte of query, in their order, ignoring the case of ASCII letters.
+    # The first bytes are gathered once per version, so the first key typed does not scan the buffer
+    def idsStartingWith(self, view, query):
+        if self.initials is None:
+            offsets = view.strings.offsets
+            buffer = view.strings.buffer
+            self.initials = bytes([ buffer[offsets[id]] for id in view.ids ])
+        ids = view.ids
+        pattern = re.compile(re.escape(query.encode()[:1]), re.IGNORECASE)
+        return array('I', [ ids[match.start()] for match in pattern.finditer(self.initials) ])
+
+    # Same as fuzzyFilter for a CompactView. A pattern with the query as a subsequence finds the candidates
+    # in the buffer, and only those are decoded and scored. bonus takes an id.
+    # The search processes cannot call bonus, they are given the frecency of the commands used from ReCP instead
+    # as (id, frecency) pairs and compute historyBonus themselves, or no bonus at all when frecencies is None
+    def fuzzyFilterView(self, view, version, query, limit, bonus, frecencies = None):
+        self.resetIfNeeded((version, True, limit))
+        if len(query) == 0:
+            return self.filterView(view, version, query)
+
+        if query not in self.results:
+            lowered = query.lower()
+            def inProcess():
+                pattern = fuzzyPattern(lowered)
+                if self.candidates is not None and lowered.startswith(self.candidates[0]) and len(self.candidates[1]) * COMPACT_SCAN_RATIO < len(view):
+                    # the candidates of a longer query are among the candidates of its prefix
+                    candidates = view.strings.matchingEntries(pattern, self.candidates[1], False)
+                else:
+                    candidates = array('I', view.strings.matchingIds(pattern, False))
+                self.candidates = (lowered, candidates)
+
+                scored = []
+                for id in candidates:
+                    score = fuzzyScore(lowered, view.strings[id])
+                    if score is not None:
+                        scored.append((score + bonus(id), id))
+                return heapq.nlargest(limit, scored)
+
+            scored = self.inParallel(view, lambda search: search.fuzzy(lowered, limit, frecencies), inProcess)
+            if scored is None:
+                return None
+            ids = array('I', map(lambda x: x[1], scored))
+            self.results = { query: CompactView(view.strings, ids) }
+        return self.results[query]
+
+    # Runs parallel with the ParallelSearch when the view is large enough, otherwise or when it fails inProcess
+    def inParallel(self, view, parallel, inProcess):
+        if self.parallelSearch is not None and self.parallelSearch.handles(len(view)):
+            try:
+                return parallel(self.parallelSearch)
+            except (OSError, RuntimeError):
+                # e.g. no shared memory or no processes available, search in this process from now on
+                self.parallelSearch.close()
+                self.parallelSearch = None
+        return inProcess()
+
+    def cancelParallelSearch(self):
+        if self.parallelSearch is not None:
+            self.parallelSearch.cancel()
+
+    # Returns (pattern, isAnchored). Like compiledPattern the query matches at the start of an entry,
+    # and a query that is not a valid regex is looked up as plain text anywhere in it
+    def compiledBytesPattern(self, query):
+        if query not in self.bytesPatterns:
+            try:
+                self.bytesPatterns[query] = (re.compile(b"^(?:" + query.encode() + b")", re.IGNORECASE | re.MULTILINE), True)
+            except re.error:
+                self.bytesPatterns[query] = (re.compile(re.escape(query.encode())), False)
+        return self.bytesPatterns[query]
+
+    def compiledPattern(self, query):
+        if query not in self.patterns:
+            try:
+                self.patterns[query] = re.compile(query, re.IGNORECASE)
+            except re.error:
+                self.patterns[query] = None
+        return self.patterns[query]
+
+
+# A refined query matches its previous results one by one when they are fewer than 1 / COMPACT_SCAN_RATIO of the corpus.
+# Matching one entry costs about twice what scanning past one in the buffer does, and every match found by the scan costs more
+COMPACT_SCAN_RATIO = 2
+
+def isLiteralQuery(query):
+    return REGEX_SPECIAL_CHARACTERS.isdisjoint(query)
+
+
+FUZZY_MATCH_SCORE = 16
+FUZZY_CONSECUTIVE_BONUS = 8
+FUZZY_BOUNDARY_BONUS = 8
+FUZZY_GAP_PENALTY = 1
+FUZZY_RECENCY_WEIGHT = 12
+FUZZY_FREQUENCY_WEIGHT = 4
+FUZZY_FRECENCY_WEIGHT = 8
+FUZZY_RESULT_LIMIT = 1000
+
+# Inverted index from each character to the search strings containing it.
+# A subsequence match must contain every character of the query, so intersecting the postings of the query characters
+# gives the candidates without scanning the whole corpus. When the query grows, only the matches of the previous one
+# are candidates, and their bonus is not computed again
+class FuzzyIndex:
+    def __init__(self):
+        self.postings = {} # character -> set of search strings
+        self.items = {} # search string -> item
+        self.version = None
+        self.matches = None # (lowered query, { search string: bonus }) of the last search
+
+    def update(self, itemsSearchTuples, version):
+        items = { key: item for item, key in itemsSearchTuples }
+        for key in self.items.keys() - items.keys():
+            for character in set(key.lower()):
+                self.postings[character].discard(key)
+        for key in items.keys() - self.items.keys():
+            for character in set(key.lower()):
+                self.postings.setdefault(character, set()).add(key)
+        self.items = items
+        self.version = version
+        self.matches = None
+
+    def search(self, query, limit, bonus):
+        query = query.lower()
+        if self.matches is not None and query.startswith(self.matches[0]):
+            candidates = self.matches[1]
+            for character in set(query[len(self.matches[0]):]):
+                posting = self.postings.get(character, set())
+                candidates = { key: value for key, value in candidates.items() if key in posting }
+        else:
+            postings = sorted((self.postings.get(character, set()) for character in set(query)), key=len)
+            candidates = dict.fromkeys(postings[0].intersection(*postings[1:]))
+
+        matches = {}
+        scored = []
+        for key, keyBonus in candidates.items():
+            score = fuzzyScore(query, key)
+            if score is not None:
+                if keyBonus is None:
+                    keyBonus = bonus(self.items[key])
+                matches[key] = keyBonus
+                scored.append((score + keyBonus, key))
+        self.matches = (query, matches)
+
+        # only the visible rows need to be ordered
+        return list(map(lambda x: self.items[x[1]], heapq.nlargest(limit, scored)))
+
+
+# Scores the query as a subsequence of the text like fzf does: the match is found left to right, then tightened
+# right to left, and consecutive characters or characters at the start of a word are rewarded while gaps are penalised
+def fuzzyScore(query, text):
+    lowered = text.lower()
+    position = -1
+    for character in query:
+        position = lowered.find(character, position + 1)
+        if position < 0:
+            return None
+
+    end = position
+    for character in reversed(query[:-1]):
+        position = lowered.rfind(character, 0, position)
+
+    score = 0
+    previous = None
+    for character in query:
+        position = lowered.find(character, position if previous is None else previous + 1, end + 1)
+        score += FUZZY_MATCH_SCORE
+        if previous is not None and position == previous + 1:
+            score += FUZZY_CONSECUTIVE_BONUS
+        elif previous is not None:
+            score -= FUZZY_GAP_PENALTY * (position - previous - 1)
+        if position == 0 or not lowered[position - 1].isalnum():
+            score += FUZZY_BOUNDARY_BONUS
+        previous = position
+    return score
+
+# The query as a subsequence within one line of an entry, for the fuzzy candidates
+def fuzzyPattern(query):
+    return re.compile(b"[^\n]*?".join(map(lambda character: re.escape(character.encode()), query)), re.IGNORECASE)
+
+# The part of the fuzzy score of a history command that does not depend on the query: how often and how recently
+# it was run, and how often it was used from ReCP
+def historyBonus(count, recency, frecency):
+    return FUZZY_RECENCY_WEIGHT * recency + FUZZY_FREQUENCY_WEIGHT * math.log2(1 + count) + FUZZY_FRECENCY_WEIGHT * math.log2(1 + frecency)
+
+# historyBonus of any command, looked up in the history index and the usage log
+def commandBonus(historyIndex, usageLog, command):
+    id = historyIndex.idOf(command)
+    if id is None:
+        return historyBonus(0, 0, usageLog.frecency(command))
+    return historyBonus(historyIndex.counts[id], historyIndex.sequences[id] / historyIndex.runs, usageLog.frecency(command))
+
+
+PARALLEL_SEARCH_MIN_ENTRIES = 200000
+PARALLEL_SEARCH_MAX_WORKERS = 8
+PARALLEL_SEARCH_SHARDS_PER_WORKER = 4
+PARALLEL_SEARCH_CHUNK_ENTRIES = 4096 # entries scanned between two checks for a newer query
+
+# Searches a HistoryIndex with a pool of processes. The index is copied to a shared memory block whenever it changed,
+# the ids are split into contiguous shards, and the per shard results (the matching ids, or the top fuzzy matches)
+# are merged here. A newer query cancels the shards still queued and stops the running ones at their next chunk.
+# The methods return None until every shard is done, so the interface keeps responding meanwhile
+class ParallelSearch:
+    def __init__(self, historyIndex):
+        self.historyIndex = historyIndex
+        self.workers = min(os.cpu_count() or 1, PARALLEL_SEARCH_MAX_WORKERS)
+        self.executor = None
+        self.generation = None # shared with the processes, bumped to stop the shards of a stale query
+        self.snapshot = None
+        self.snapshotVersion = None
+        self.task = None # (key, generation, futures) of the latest query
+
+    # Below a few hundred thousand entries the processes cost more than they save
+    def handles(self, count):
+        return self.workers > 1 and count >= PARALLEL_SEARCH_MIN_ENTRIES
+
+    # Returns the set of matching ids
+    def matchingIds(self, pattern, isAnchored):
+        results = self.run(("match", pattern.pattern, pattern.flags, isAnchored))
+        if results is None:
+            return None
+        ids = set()
+        for result in results:
+            ids.update(arrayFromBytes('I', result))
+        return ids
+
+    # Returns the best (score, id) matches, best first
+    def fuzzy(self, query, limit, frecencies):
+        results = self.run(("fuzzy", query, limit, frecencies))
+        if results is None:
+            return None
+        return heapq.nlargest(limit, itertools.chain.from_iterable(results))
+
+    def run(self, arguments):
+        key = (self.historyIndex.version, arguments)
+        if self.task is None or self.task[0] != key:
+            self.cancel()
+            self.start()
+            self.publish()
+            count = len(self.historyIndex)
+            size = -(-count // (self.workers * PARALLEL_SEARCH_SHARDS_PER_WORKER))
+            generation = self.generation.value
+            futures = [ self.executor.submit(searchShard, self.snapshot.name, first, min(first + size, count), generation, arguments) for first in range(0, count, size) ]
+            self.task = (key, generation, futures)
+
+        _, generation, futures = self.task
+        if not all(map(lambda future: future.done(), futures)):
+            return None
+        return list(map(lambda future: future.result(), futures))
+
+    def cancel(self):
+        if self.task is None:
+            return
+        self.generation.value += 1
+        for future in self.task[2]:
+            future.cancel()
+        self.task = None
+
+    def start(self):
+        if self.executor is not None:
+            return
+        import concurrent.futures
+        import multiprocessing
+        # spawned rather than forked, the interface has threads running
+        context = multiprocessing.get_context("spawn")
+        self.generation = context.RawValue('Q', 0)
+        self.executor = concurrent.futures.ProcessPoolExecutor(self.workers, context, initializer = initializeSearchWorker, initargs = (self.generation,))
+
+    # Copies the index to a new shared memory block: a header, the offsets, the counts, the sequences and the buffer
+    def publish(self):
+        index = self.historyIndex
+        if self.snapshotVersion == index.version:
+            return
+        from multiprocessing import shared_memory
+        count = len(index)
+        offsets = index.strings.offsets[:count + 1]
+        header = array('Q', [count, offsets[count], index.runs])
+        parts = [ header, offsets, index.counts[:count], index.sequences[:count] ]
+        size = sum(map(lambda part: len(part) * part.itemsize, parts)) + offsets[count]
+        snapshot = shared_memory.SharedMemory(create = True, size = size)
+        position = 0
+        for part in parts:
+            data = part.tobytes()
+            snapshot.buf[position:position + len(data)] = data
+            position += len(data)
+        with memoryview(index.strings.buffer) as buffer:
+            snapshot.buf[position:position + offsets[count]] = buffer[:offsets[count]]
+
+        # the processes still reading the previous block keep their mapping until they move to this one
+        self.closeSnapshot()
+        self.snapshot = snapshot
+        self.snapshotVersion = index.version
+
+    def closeSnapshot(self):
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot.unlink()
+            self.snapshot = None
+            self.snapshotVersion = None
+
+    def close(self):
+        self.cancel()
+        if self.executor is not None:
+            self.executor.shutdown(wait = False, cancel_futures = True)
+            self.executor = None
+        self.closeSnapshot()
+
+
+# State of a search process: the generation counter, and the snapshot it is attached to
+SEARCH_WORKER = { 'generation': None, 'name': None, 'memory': None, 'views': [], 'snapshot': None }
+
+def initializeSearchWorker(generation):
+    SEARCH_WORKER['generation'] = generation
+
+# Returns (strings, counts, sequences, runs) read from the shared memory block, attaching to it the first time
+def attachedSnapshot(name):
+    if SEARCH_WORKER['name'] != name:
+        from multiprocessing import shared_memory
+        for view in SEARCH_WORKER['views']:
+            view.release()
+        if SEARCH_WORKER['memory'] is not None:
+            SEARCH_WORKER['memory'].close()
+
+        # the processes share the resource tracker of the interface, which unlinks the block
+        memory = shared_memory.SharedMemory(name)
+        count, bufferSize, runs = memory.buf[:24].cast('Q')
+        position = 24
+        views = []
+        for itemCount in [count + 1, count, count]:
+            views.append(memory.buf[position:position + itemCount * 4].cast('I'))
+            position += itemCount * 4
+        views.append(memory.buf[position:position + bufferSize])
+
+        strings = CompactStrings()
+        strings.offsets = views[0]
+        strings.buffer = views[3]
+        SEARCH_WORKER.update({ 'name': name, 'memory': memory, 'views': views, 'snapshot': (strings, views[1], views[2], runs) })
+    return SEARCH_WORKER['snapshot']
+
+# Runs in a search process. Returns the matching ids as bytes of an array('I') for a match,
+# the best (score, id) matches for fuzzy, or None when a newer query came in
+def searchShard(name, first, last, generation, arguments):
+    strings, counts, sequences, runs = attachedSnapshot(name)
+    isStale = lambda: SEARCH_WORKER['generation'].value != generation
+
+    if arguments[0] == "match":
+        _, source, flags, isAnchored = arguments
+        pattern = re.compile(source, flags)
+        ids = array('I')
+        for start in range(first, last, PARALLEL_SEARCH_CHUNK_ENTRIES):
+            if isStale():
+                return None
+            ids.extend(strings.matchingIds(pattern, isAnchored, start, min(start + PARALLEL_SEARCH_CHUNK_ENTRIES, last)))
+        return ids.tobytes()
+
+    _, query, limit, frecencies = arguments
+    pattern = fuzzyPattern(query)
+    frecencyById = dict(frecencies or [])
+    scored = []
+    for start in range(first, last, PARALLEL_SEARCH_CHUNK_ENTRIES):
+        if isStale():
+            return None
+        for id in strings.matchingIds(pattern, False, start, min(start + PARALLEL_SEARCH_CHUNK_ENTRIES, last)):
+            score = fuzzyScore(query, strings[id])
+            if score is not None:
+                if frecencies is not None:
+                    score += historyBonus(counts[id], sequences[id] / runs, frecencyById.get(id, 0))
+                scored.append((score, id))
+    return heapq.nlargest(limit, scored)
+
+
+#
+# Config
+#
+
+class Config:
+    # directory is given by the daemon, which looks up the files of its clients and never prompts
+    def __init__(self, directory = None):
+        self.directory = directory
+        with PROFILE.phase("config discovery"):
+            filePaths = self.getFilePaths()
+
+        self.stores = []
+        self.mergedRecipes = []
+        self.mergedVersion = None
+        if len(filePaths) == 0:
+            if directory is None:
+                self.setup()
+            return
+
+        # the nearest file comes first and receives the new recipes
+        with PROFILE.phase("config parse"):
+            self.stores = list(map(lambda x: RecipeStore(x), filePaths))
+            for store in self.stores:
+                store.load()
+                if directory is not None:
+                    # the daemon and the scripting commands keep stdout for their output
+                    continue
+                if store.isEmpty:
+                    # there is a file, but it is not initialized.
+                    log(f"Initializing empty config file: {store.path}")
+                else:
+                    print(f"Found config file: {store.path}")
+
+    # The recipes of every layer, each labeled with the file it comes from
+    @property
+    def recipes(self):
+        if self.mergedVersion != self.version:
+            self.mergedRecipes = [ dict(recipe, source=store.path) for store in self.stores for recipe in store.recipes ]
+            self.mergedVersion = self.version
+        return self.mergedRecipes
+
+    @property
+    def source(self):
+        return self.stores[0].path
+
+    @property
+    def version(self):
+        return tuple(map(lambda x: x.version, self.stores))
+
+    def label(self, recipe):
+        directory = os.path.dirname(recipe['source'])
+        home = os.path.expanduser('~')
+        if directory == home or directory.startswith(home + "/"):
+            directory = "~" + directory[len(home):]
+        return directory
+
+    # Reload the files that changed on disk
+    def refresh(self):
+        for store in self.stores:
+            store.refresh()
+
+    def addRecipe(self, recipe):
+        self.stores[0].add(recipe)
+
+    def removeRecipe(self, recipe):
+        store = next(filter(lambda x: x.path == recipe.get('source'), self.stores), self.stores[0])
+        store.remove(recipe['recipe'])
+
+    def addRecipes(self, recipes):
+        self.stores[0].commit(list(map(lambda x: { 'op': 'add', 'recipe': x }, recipes)))
+
+    # Removes the commands from every file that has them, returns how many recipes were removed
+    def removeCommands(self, commands):
+        removed = 0
+        for store in self.stores:
+            matching = set(commands).intersection(map(lambda x: x['recipe'], store.recipes))
+            if len(matching) > 0:
+                before = len(store.recipes)
+                store.commit(list(map(lambda x: { 'op': 'remove', 'recipe': x }, matching)))
+                removed += before - len(store.recipes)
+        return removed
 
     def providedConfigPath(self):
-        filteredArgs = list(filter(lambda x: (x not in ['--debug']), sys.argv))
-        if len(filteredArgs) > 1:
+        filteredArgs, _ = parsedArguments(sys.argv[1:], OPTIONS_WITH_VALUE)
+        if len(filteredArgs) > 0:
             return filteredArgs[-1]
         return None
     
-    def getFilePath(self):
-        filePath = self.providedConfigPath()
+    def getFilePaths(self):
+        filePath = self.providedConfigPath() if self.directory is None else None
         
         if filePath is not None and os.path.isfile(filePath):
             # try to use the provided config file
-            return filePath
-        else:
-            # check if there is a .repc file at the calling site or any parent directories
-            currentPath = os.getcwd()
-            while currentPath != "/":
-                if os.path.isfile(os.path.join(currentPath, CONFIG_FILE_NAME)):
-                    return os.path.join(currentPath, CONFIG_FILE_NAME)
-                currentPath = currentPath[:currentPath.rfind('/')]
-            
-            # check if there is one at user path
-            userConfig = os.path.join(os.path.expanduser('~'), CONFIG_FILE_NAME)
-            if os.path.isfile(userConfig):
-                return userConfig
-            else:
-                return None
+            return [filePath]
+
+        # every .recp file at the calling site and in any parent directory, then the one at user path
+        directories = []
+        currentPath = self.directory or os.getcwd()
+        while currentPath != "/" and len(currentPath) > 0:
+            directories.append(currentPath)
+            currentPath = currentPath[:currentPath.rfind('/')]
+        userPath = os.path.expanduser('~')
+        if userPath not in directories:
+            directories.append(userPath)
+
+        return list(filter(os.path.isfile, map(lambda x: os.path.join(x, CONFIG_FILE_NAME), directories)))
 
     def setup(self):
         filePath = self.providedConfigPath()
@@ -553,16 +2397,645 @@ class Config:
         if val == 'n':
             exit(0)
 
-        self.recipes = []
-        self.source = filePath
+        self.stores = [RecipeStore(filePath)]
         self.save()
 
     def save(self):
-        dict = {
-            'recipes': self.recipes
-        }
-        with open(self.source, 'w') as fp:
-            json.dump(dict, fp)
+        for store in self.stores:
+            store.save()
+
+
+JOURNAL_COMPACTION_ENTRIES = 1000
+
+# A .recp file. Every change is made under an exclusive lock on top of the latest content on disk, so instances
+# running in different terminals merge their edits, and the file is only ever replaced atomically.
+# With "journal": true in the file, changes are appended to a .journal file next to it instead of rewriting it,
+# and folded back into the .recp file every JOURNAL_COMPACTION_ENTRIES changes
+class RecipeStore:
+    def __init__(self, path):
+        self.path = path
+        self.recipes = []
+        self.settings = {} # any other key of the file, kept as it is
+        self.isEmpty = True
+        self.journalOffset = 0
+        self.journalEntries = 0
+        self.stamp = None
+        self.version = 0
+
+    def journalPath(self):
+        return f"{self.path}.journal"
+
+    def isJournaled(self):
+        return self.settings.get('journal', False) == True
+
+    def load(self):
+        with self.lock():
+            self.read()
+
+    def refresh(self):
+        if self.fileStamp() != self.stamp:
+            self.load()
+
+    # Identifies the content of the file and of its journal without reading them
+    def fileStamp(self):
+        stamp = []
+        for path in [self.path, self.journalPath()]:
+            try:
+                stat = os.stat(path)
+                stamp.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                stamp.append(None)
+        return stamp
+
+    def save(self):
+        with self.lock():
+            self.write()
+            self.version += 1
+
+    def add(self, recipe):
+        self.commit([{ 'op': 'add', 'recipe': recipe }])
+
+    def remove(self, command):
+        self.commit([{ 'op': 'remove', 'recipe': command }])
+
+    # Applies all the operations under a single lock and a single write
+    def commit(self, operations):
+        with self.lock():
+            if self.isJournaled():
+                stamp = self.fileStamp()
+                if self.stamp is None or stamp[0] != self.stamp[0] or stamp[1] is None or stamp[1][1] < self.journalOffset:
+                    # another instance folded the journal into the file, which replaced the file (new inode)
+                    # and truncated the journal, that may have grown past the offset read here since
+                    self.read()
+                with open(self.journalPath(), 'a', encoding='utf-8') as file:
+                    file.write("".join(map(lambda x: json.dumps(x) + "\n", operations)))
+                    file.flush()
+                    os.fsync(file.fileno())
+                # replaying the journal tail applies this change along with the ones from other instances
+                self.readJournal()
+                if self.journalEntries >= JOURNAL_COMPACTION_ENTRIES:
+                    self.write()
+                    os.truncate(self.journalPath(), 0)
+                    self.journalOffset = 0
+                    self.journalEntries = 0
+            else:
+                # another instance may have changed the file since it was loaded
+                self.read()
+                for operation in operations:
+                    self.apply(operation)
+                self.write()
+            self.stamp = self.fileStamp()
+            self.version += 1
+
+    def apply(self, operation):
+        if operation['op'] == 'add':
+            self.recipes.append(operation['recipe'])
+        elif operation['op'] == 'remove':
+            self.recipes = list(filter(lambda x: x['recipe'] != operation['recipe'], self.recipes))
+
+    # The lock must be held when calling read, readJournal and write
+
+    def read(self):
+        self.stamp = self.fileStamp()
+        with open(self.path, 'r') as file:
+            jsonStr = file.read()
+        self.isEmpty = jsonStr.strip() == ""
+        dictionary = { } if self.isEmpty else json.loads(jsonStr)
+        self.recipes = dictionary.pop('recipes', [])
+        self.settings = dictionary
+        self.journalOffset = 0
+        self.journalEntries = 0
+        self.readJournal()
+        self.version += 1
+
+    def readJournal(self):
+        try:
+            with open(self.journalPath(), 'rb') as file:
+                file.seek(self.journalOffset)
+                data = file.read()
+        except FileNotFoundError:
+            return
+
+        # a line without its newline is still being written
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            try:
+                self.apply(json.loads(line))
+            except (ValueError, KeyError):
+                continue
+            self.journalEntries += 1
+        self.journalOffset += end
+
+    def write(self):
+        dictionary = dict(self.settings)
+        dictionary['recipes'] = self.recipes
+        # a symlinked file (e.g. from a dotfiles repository) is replaced at its target, keeping the link and its mode
+        path = os.path.realpath(self.path)
+        tempPath = f"{path}.{os.getpid()}.tmp"
+        with open(tempPath, 'w') as fp:
+            json.dump(dictionary, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        try:
+            os.chmod(tempPath, os.stat(path).st_mode & 0o7777)
+        except OSError:
+            pass
+        os.replace(tempPath, path)
+        self.isEmpty = False
+
+    # The lock is taken on a file in the cache directory, the .recp file itself is replaced on every write
+    @contextlib.contextmanager
+    def lock(self):
+        os.makedirs(cacheDirectory(), exist_ok=True)
+        with open(os.path.join(cacheDirectory(), f"lock-{pathDigest(os.path.realpath(self.path))}"), 'w') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+
+#
+# Daemon
+#
+
+DAEMON_POLL_SECONDS = 1
+DAEMON_CONNECT_TIMEOUT_SECONDS = 0.5
+DAEMON_READ_TIMEOUT_SECONDS = 5 # between two reads, a peer silent for longer is given up on
+
+# Keeps the history index, the recipe stores and the search indexes in memory and answers ReCP instances over a Unix socket.
+# Requests and responses are one JSON object per line, except for the history which is sent as count\tcommand\0 entries.
+# The history is sent to the interface, the query results to `recp query`
+class Daemon:
+    def __init__(self):
+        self.historyIndex = HistoryIndex()
+        self.historyStore = HistorySources(historySourcePaths())
+        self.usagePath = os.path.join(dataDirectory(), "usage.log")
+        self.usageLog = None
+        self.usageStamp = None
+        self.historyTuples = (None, []) # (version, query tuples of the history)
+        self.configs = {} # directory -> Config
+        self.queryFilters = {} # directory -> SearchFilter
+
+    def serve(self):
+        import socket
+        path = daemonSocketPath()
+        connection = daemonConnection()
+        if connection is not None:
+            connection.close()
+            log(f"A ReCP daemon is already listening on {path}")
+            return
+
+        self.loadHistory()
+
+        # a socket left behind by a daemon that did not shut down cleanly
+        if os.path.exists(path):
+            os.unlink(path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # the socket serves the whole history, it is created accessible to this user only, never chmod-ed afterwards
+        umask = os.umask(0o077)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            server.bind(path)
+        finally:
+            os.umask(umask)
+        server.listen()
+        server.settimeout(DAEMON_POLL_SECONDS)
+        log(f"ReCP daemon listening on {path}")
+
+        # let the socket be removed on kill too
+        import signal
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+        try:
+            while True:
+                try:
+                    connection, _ = server.accept()
+                except socket.timeout:
+                    # watch the history file while idle
+                    self.refresh()
+                    continue
+                with connection:
+                    # one connection at a time, a client that stops reading or writing must not block the others
+                    connection.settimeout(DAEMON_READ_TIMEOUT_SECONDS)
+                    self.handle(connection)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            os.unlink(path)
+
+    def loadHistory(self):
+        self.historyStore = HistorySources(historySourcePaths())
+        self.historyIndex.reset()
+        self.historyIndex.extend(self.historyStore.load().encodedItems())
+        for historyPath, error in self.historyStore.errors.items():
+            log(f"History not loaded from {historyPath}: {error!r}")
+
+    def refresh(self):
+        commands = self.historyStore.refresh()
+        if commands is None:
+            # a file was rewritten (zsh saves through a rename), extending would count its commands twice
+            self.loadHistory()
+        else:
+            self.historyIndex.extend(commands)
+        for config in self.configs.values():
+            config.refresh()
+        # the ReCP instances append to the usage log, it is read again when it changed
+        try:
+            stat = os.stat(self.usagePath)
+            stamp = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            stamp = None
+        if self.usageLog is None or stamp != self.usageStamp:
+            self.usageLog = UsageLog(self.usagePath)
+            self.usageStamp = stamp
+
+    def handle(self, connection):
+        file = connection.makefile('rwb')
+        try:
+            line = file.readline()
+            if len(line) == 0:
+                # a client checking whether the daemon is running
+                return
+            request = json.loads(line)
+            self.refresh()
+            if request.get('version') != VERSION:
+                self.respond(file, { 'error': f"daemon version {VERSION}" })
+            elif request.get('op') == 'history':
+                self.sendHistory(file)
+            elif request.get('op') == 'query':
+                self.sendQuery(file, request)
+            else:
+                self.respond(file, { 'error': f"unknown op {request.get('op')}" })
+            file.flush()
+        except (OSError, ValueError) as error:
+            log(f"Request failed: {error!r}")
+
+    def respond(self, file, dictionary):
+        file.write(json.dumps(dictionary).encode() + b"\n")
+
+    # Oldest first, the order HistoryIndex.extendCounted expects
+    def sendHistory(self, file):
+        entries = map(lambda entry: b"%d\t%s\0" % (entry[1], entry[0]), self.historyIndex.countedEntries())
+        file.write(b"".join(entries))
+
+    # The same matches runQuery finds in process, as the JSON lines of `recp query --format json`. The query tuples
+    # and the fuzzy index of each directory are kept until its recipes, the history or the usage log change
+    def sendQuery(self, file, request):
+        directory = request.get('cwd', os.path.expanduser('~'))
+        if directory not in self.configs:
+            self.configs[directory] = Config(directory)
+            self.queryFilters[directory] = SearchFilter()
+        config = self.configs[directory]
+
+        historyVersion = (self.historyIndex.version, self.usageStamp)
+        if self.historyTuples[0] != historyVersion:
+            self.historyTuples = (historyVersion, historyQueryTuples(self.historyIndex, self.usageLog))
+        itemsSearchTuples = recipeQueryTuples(config, self.usageLog) + self.historyTuples[1]
+
+        limit = request.get('limit')
+        matches = queryMatches(self.queryFilters[directory], itemsSearchTuples, (config.version, historyVersion), self.historyIndex, self.usageLog, request.get('pattern', ""), request.get('fuzzy', False), limit)
+        for item in itertools.islice(matches, limit):
+            file.write(formattedQueryItem(item, "json").encode())
+
+def daemonSocketPath():
+    runtimeDirectory = os.environ.get("XDG_RUNTIME_DIR")
+    if runtimeDirectory is not None:
+        return os.path.join(runtimeDirectory, "recp.sock")
+    return os.path.join(cacheDirectory(), "daemon.sock")
+
+# Returns a connected socket, or None when no daemon is running
+def daemonConnection():
+    import socket
+    path = daemonSocketPath()
+    if os.path.exists(path) == False:
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(DAEMON_CONNECT_TIMEOUT_SECONDS)
+    try:
+        connection.connect(path)
+    except OSError:
+        connection.close()
+        return None
+    return connection
+
+# Returns (command, count) entries oldest first, or None when no daemon answered
+def daemonHistory():
+    connection = daemonConnection()
+    if connection is None:
+        return None
+    with connection:
+        try:
+            connection.sendall(json.dumps({ 'op': "history", 'version': VERSION }).encode() + b"\n")
+            connection.settimeout(DAEMON_READ_TIMEOUT_SECONDS)
+            data = connection.makefile('rb').read()
+        except OSError:
+            return None
+
+    # a daemon of another version answers with an error line instead
+    if data.startswith(b"{"):
+        return None
+    entries = []
+    for entry in data.decode('utf-8', errors='replace').split("\0")[:-1]:
+        count, command = entry.split("\t", 1)
+        entries.append((command, int(count)))
+    return entries
+
+# Returns the (kind, value) items matching the query as they are received, or None when no daemon answered
+def daemonQuery(pattern, isFuzzy, limit):
+    connection = daemonConnection()
+    if connection is None:
+        return None
+    try:
+        request = { 'op': "query", 'version': VERSION, 'cwd': os.getcwd(), 'pattern': pattern, 'fuzzy': isFuzzy, 'limit': limit }
+        connection.sendall(json.dumps(request).encode() + b"\n")
+        connection.settimeout(DAEMON_READ_TIMEOUT_SECONDS)
+        file = connection.makefile('rb')
+        line = file.readline()
+        # a daemon of another version answers with an error line instead
+        if len(line) > 0 and 'error' in json.loads(line):
+            connection.close()
+            return None
+    except (OSError, ValueError):
+        connection.close()
+        return None
+    return daemonQueryItems(connection, file, line)
+
+def daemonQueryItems(connection, file, line):
+    with connection:
+        while len(line) > 0:
+            dictionary = json.loads(line)
+            if dictionary['kind'] == "recipe":
+                yield ("recipe", { 'title': dictionary['title'], 'recipe': dictionary['command'], 'source': dictionary['source'] })
+            else:
+                yield ("history", dictionary['command'])
+            line = file.readline()
+
+
+#
+# Scripting
+#
+
+QUERY_FORMATS = ["text", "json", "nul"]
+
+# recp query <pattern> [--limit N] [--format text|json|nul] [--fuzzy]
+# Prints the matching recipes, then the matching history, as soon as each match is found
+def runQuery(arguments):
+    positional, options = parsedArguments(arguments, ["--limit", "--format"])
+    pattern = " ".join(positional)
+    limit = int(options.get("--limit", 0)) or None
+    format = options.get("--format", "text")
+    if format not in QUERY_FORMATS:
+        log(f"Unknown format {format}, use one of {', '.join(QUERY_FORMATS)}")
+        return 2
+
+    isFuzzy = "--fuzzy" in options
+    # a running daemon has everything loaded and searches for us
+    matches = daemonQuery(pattern, isFuzzy, limit)
+    if matches is None:
+        config = Config(os.getcwd())
+        usageLog = UsageLog(os.path.join(dataDirectory(), "usage.log"))
+        historyIndex = HistoryIndex()
+        historyIndex.extend(HistorySources(historySourcePaths()).load().encodedItems())
+        itemsSearchTuples = recipeQueryTuples(config, usageLog) + historyQueryTuples(historyIndex, usageLog)
+        matches = queryMatches(SearchFilter(), itemsSearchTuples, 0, historyIndex, usageLog, pattern, isFuzzy, limit)
+
+    try:
+        for count, item in enumerate(matches):
+            if limit is not None and count >= limit:
+                break
+            sys.stdout.write(formattedQueryItem(item, format))
+            sys.stdout.flush()
+    except BrokenPipeError:
+        # the reader went away, e.g. `recp query docker | head`
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    except (OSError, ValueError) as error:
+        # the daemon stopped answering midway
+        log(f"Query failed: {error!r}")
+        return 1
+    return 0
+
+# (item, search string) tuples of the recipes, the ones used from ReCP first
+def recipeQueryTuples(config, usageLog):
+    recipes = usageLog.ranked(config.recipes, lambda x: x['recipe'])
+    return list(map(lambda x: (("recipe", x), f"{x['title']} {x['recipe']}"), recipes))
+
+# (item, search string) tuples of the history, the commands used from ReCP first
+def historyQueryTuples(historyIndex, usageLog):
+    history = usageLog.ranked(historyIndex.commands(), lambda x: x)
+    return list(map(lambda x: (("history", x), x), history))
+
+# The matching (kind, value) items, yielded as they are found unless they are ranked by a fuzzy search,
+# which gives them the bonus they get in the interface
+def queryMatches(searchFilter, itemsSearchTuples, version, historyIndex, usageLog, pattern, isFuzzy, limit):
+    if isFuzzy and len(pattern) > 0:
+        # ranking needs every candidate, so fuzzy matches are printed once they are all scored
+        bonus = lambda item: commandBonus(historyIndex, usageLog, commandForQueryItem(item))
+        return searchFilter.fuzzyFilter(itemsSearchTuples, version, pattern, limit or FUZZY_RESULT_LIMIT, bonus)
+    return searchFilter.matches(itemsSearchTuples, pattern)
+
+def commandForQueryItem(item):
+    kind, value = item
+    return value['recipe'] if kind == "recipe" else value
+
+def formattedQueryItem(item, format):
+    kind, value = item
+    command = commandForQueryItem(item)
+    if format == "json":
+        dictionary = { 'kind': kind, 'command': command }
+        if kind == "recipe":
+            dictionary['title'] = value['title']
+            dictionary['source'] = value['source']
+        return json.dumps(dictionary) + "\n"
+    elif format == "nul":
+        return command + "\0"
+    return command.replace("\n", " ") + "\n"
+
+# recp add <title> <command> [<title> <command> ...]
+# recp add - reads tab separated title and command lines from stdin
+def runAdd(arguments):
+    positional, _ = parsedArguments(arguments, [])
+    if positional == ["-"]:
+        pairs = [ line.rstrip("\n").split("\t", 1) for line in sys.stdin if "\t" in line ]
+    elif len(positional) > 0 and len(positional) % 2 == 0:
+        pairs = [ positional[i:i + 2] for i in range(0, len(positional), 2) ]
+    else:
+        log("Usage: recp add <title> <command> [<title> <command> ...] | recp add -")
+        return 2
+
+    config = Config(os.getcwd())
+    if len(config.stores) == 0:
+        log(f"No {CONFIG_FILE_NAME} file found, run recp once to create one")
+        return 1
+    config.addRecipes([ { 'recipe': command.strip(), 'title': title.strip() } for title, command in pairs ])
+    log(f"Added {len(pairs)} recipes to {config.source}")
+    return 0
+
+# recp rm <command> [<command> ...]
+# recp rm - reads one command per line from stdin
+def runRemove(arguments):
+    positional, _ = parsedArguments(arguments, [])
+    if positional == ["-"]:
+        commands = [ line.strip() for line in sys.stdin if len(line.strip()) > 0 ]
+    else:
+        commands = positional
+    if len(commands) == 0:
+        log("Usage: recp rm <command> [<command> ...] | recp rm -")
+        return 2
+
+    config = Config(os.getcwd())
+    removed = config.removeCommands(commands)
+    log(f"Removed {removed} recipes")
+    return 0 if removed > 0 else 1
+
+# Splits the arguments into positional ones and --options, the ones in optionsWithValue take the next argument
+def parsedArguments(arguments, optionsWithValue):
+    positional = []
+    options = {}
+    i = 0
+    while i < len(arguments):
+        argument = arguments[i]
+        if argument in optionsWithValue and i + 1 < len(arguments):
+            options[argument] = arguments[i + 1]
+            i += 1
+        elif argument.startswith("--"):
+            options[argument] = True
+        else:
+            positional.append(argument)
+        i += 1
+    return positional, options
+
+COMMANDS = {
+    "query": runQuery,
+    "add": runAdd,
+    "rm": runRemove
+}
+
+OPTIONS_WITH_VALUE = ["--output", "--shell-init", "--trace"]
+
+# Wrapper functions printed by --shell-init, recp writes the selected command to a temporary file
+# and the wrapper runs it in the calling shell, so cd, exports and aliases behave as if typed.
+# The widget bound to Ctrl-X Ctrl-R puts the command on the prompt instead, to be edited before running.
+# __recp_log_command appends each command run and its directory to the DirectoryLog.
+SHELL_INIT_SCRIPTS = {
+    "zsh": r'''recp() {
+    # the scripting commands print their output, they do not select a command
+    case $1 in
+        query|add|rm) command recp "$@"; return ;;
+    esac
+    local output=$(mktemp "${TMPDIR:-/tmp}/recp.XXXXXX") || return
+    command recp --output "$output" "$@"
+    local cmd=$(<"$output")
+    rm -f "$output"
+    [[ -n $cmd ]] || return 0
+    print -rs -- "$cmd"
+    __recp_log_command "$cmd"
+    eval "$cmd"
+}
+__recp_log_command() {
+    print -rn -- "$EPOCHSECONDS"$'\t'"$PWD"$'\t'"$1"$'\0' >>| "$__recp_directory_log"
+}
+zmodload zsh/datetime
+autoload -Uz add-zsh-hook
+add-zsh-hook preexec __recp_log_command
+recp-widget() {
+    local output=$(mktemp "${TMPDIR:-/tmp}/recp.XXXXXX") || return
+    command recp --output "$output" </dev/tty
+    local cmd=$(<"$output")
+    rm -f "$output"
+    if [[ -n $cmd ]]; then
+        BUFFER=$cmd
+        CURSOR=$#BUFFER
+    fi
+    zle reset-prompt
+}
+zle -N recp-widget
+bindkey '^X^R' recp-widget
+''',
+    "bash": r'''recp() {
+    # the scripting commands print their output, they do not select a command
+    case $1 in
+        query|add|rm) command recp "$@"; return ;;
+    esac
+    local output cmd
+    output=$(mktemp "${TMPDIR:-/tmp}/recp.XXXXXX") || return
+    command recp --output "$output" "$@"
+    cmd=$(<"$output")
+    rm -f "$output"
+    [[ -n $cmd ]] || return 0
+    history -s -- "$cmd"
+    eval "$cmd"
+}
+# READLINE_LINE needs bash 4, the widget is left out on the bash 3.2 of macOS
+if (( BASH_VERSINFO[0] >= 4 )); then
+    __recp_widget() {
+        local output cmd
+        output=$(mktemp "${TMPDIR:-/tmp}/recp.XXXXXX") || return
+        command recp --output "$output" </dev/tty
+        cmd=$(<"$output")
+        rm -f "$output"
+        if [[ -n $cmd ]]; then
+            READLINE_LINE=$cmd
+            READLINE_POINT=${#READLINE_LINE}
+        fi
+    }
+    bind -x '"\C-x\C-r": __recp_widget'
+fi
+__recp_log_command() {
+    local entry
+    entry=$(HISTTIMEFORMAT= builtin history 1)
+    # the last entry of the history is logged once, in the directory its prompt was shown in
+    if [[ $entry =~ ^\ *([0-9]+)\*?\ +(.*)$ && ${BASH_REMATCH[1]} != "$__recp_history_number" ]]; then
+        __recp_history_number=${BASH_REMATCH[1]}
+        [[ -n $__recp_prompt_directory ]] && printf '%s\t%s\t%s\0' "${EPOCHSECONDS:-$(date +%s)}" "$__recp_prompt_directory" "${BASH_REMATCH[2]}" >> "$__recp_directory_log"
+    fi
+    __recp_prompt_directory=$PWD
+}
+PROMPT_COMMAND="${PROMPT_COMMAND:+$PROMPT_COMMAND;}__recp_log_command"
+''',
+    "fish": r'''function recp
+    # the scripting commands print their output, they do not select a command
+    switch "$argv[1]"
+        case query add rm
+            command recp $argv
+            return
+    end
+    set -l output (mktemp -t recp.XXXXXX); or return
+    command recp --output $output $argv
+    set -l cmd (string collect < $output)
+    rm -f $output
+    test -n "$cmd"; or return 0
+    __recp_log_command $cmd
+    eval $cmd
+end
+function __recp_log_command --on-event fish_preexec
+    printf '%s\t%s\t%s\0' (date +%s) $PWD $argv[1] >> $__recp_directory_log
+end
+function recp-widget
+    set -l output (mktemp -t recp.XXXXXX); or return
+    command recp --output $output </dev/tty
+    set -l cmd (string collect < $output)
+    rm -f $output
+    test -n "$cmd"; and commandline -r -- $cmd
+    commandline -f repaint
+end
+bind \cx\cr recp-widget
+'''
+}
+
+# recp --shell-init zsh|bash|fish
+def printShellInit(shell):
+    if shell not in SHELL_INIT_SCRIPTS:
+        log(f"Usage: recp --shell-init {'|'.join(SHELL_INIT_SCRIPTS)}")
+        return 2
+    # the hooks append to the directory log without creating its directory
+    import shlex
+    os.makedirs(dataDirectory(), exist_ok=True)
+    assignment = "set -g {} {}\n" if shell == "fish" else "{}={}\n"
+    sys.stdout.write(assignment.format("__recp_directory_log", shlex.quote(os.path.join(dataDirectory(), DIRECTORY_LOG_NAME))))
+    sys.stdout.write(SHELL_INIT_SCRIPTS[shell])
+    return 0
 
 
 #
@@ -578,18 +3051,133 @@ def helpIfNeeded():
         print("ReCP is utility that allows to compile a list of tty commands that can then be selected using the up and down keys or the assigned shortcut binding.")
         print("The tool looks for a .recp file at the calling directory, if none is found it will recurse the path backwards until one is found. If no .recp file is found in the path the tool looks for one in the user home space. Alternatively, a path to a .recp file can be provided as an argument. ")
         print("use the --debug flag to see debug information on screen")
+        print("recp query <pattern> [--limit N] [--format text|json|nul] [--fuzzy] prints the matching recipes and history without opening the interface")
+        print("recp add <title> <command> [<title> <command> ...] saves recipes to the nearest .recp file, recp add - reads tab separated lines from stdin")
+        print("recp rm <command> [<command> ...] deletes recipes, recp rm - reads one command per line from stdin")
+        print("recp --shell-init zsh|bash|fish prints the wrapper functions that run the selected command in the calling shell, see the README")
+        print("use the --daemon flag to keep the history and the recipes loaded in a background process, that later launches connect to")
+        print("use the --profile-startup flag to print how long each startup phase takes, up to the first frame")
+        print("use --trace <file> to write how long each part of every frame takes as Chrome trace events, --debug shows the p50 and p95 on screen")
         exit(0)
 
+# Timings of the startup phases, measured from the first line of this file
+class StartupProfile:
+    def __init__(self):
+        self.started = {}
+        self.phases = [] # (name, start, end) relative to STARTUP_TIME
+
+    def begin(self, name):
+        self.started[name] = time.perf_counter()
+
+    def end(self, name):
+        if name in self.started:
+            self.phases.append((name, self.started.pop(name) - STARTUP_TIME, time.perf_counter() - STARTUP_TIME))
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end(name)
+
+    def report(self):
+        print(f"{'phase':<20}{'start ms':>10}{'duration ms':>14}")
+        for name, start, end in sorted(self.phases, key=lambda x: x[1]):
+            print(f"{name:<20}{start * 1000:>10.1f}{(end - start) * 1000:>14.1f}")
+        total = max(map(lambda x: x[2], self.phases), default=0)
+        print(f"{'total':<20}{0:>10.1f}{total * 1000:>14.1f}")
+
+FRAME_METRICS_WINDOW = 240 # frames, 4 seconds at 60 fps
+
+# Durations of the work done for each frame over the last FRAME_METRICS_WINDOW frames, shown by --debug.
+# With a trace path each duration is also appended to the file as a Chrome trace event, which Perfetto and
+# chrome://tracing open as they are, without the closing bracket of the array
+class FrameMetrics:
+    def __init__(self, tracePath = None):
+        self.durations = {} # phase -> the last durations in seconds, in the order the phases were first measured
+        self.trace = None
+        if tracePath is not None:
+            self.trace = open(tracePath, 'w')
+            self.trace.write("[\n")
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter())
+
+    def record(self, name, start, end):
+        if name not in self.durations:
+            self.durations[name] = collections.deque(maxlen = FRAME_METRICS_WINDOW)
+        self.durations[name].append(end - start)
+        if self.trace is not None:
+            event = { 'name': name, 'ph': "X", 'ts': round((start - STARTUP_TIME) * 1e6), 'dur': round((end - start) * 1e6), 'pid': os.getpid(), 'tid': 0 }
+            self.trace.write(json.dumps(event) + ",\n")
+
+    # (phase, last, p50, p95) for each phase, in milliseconds
+    def summary(self):
+        rows = []
+        for name, durations in self.durations.items():
+            ordered = sorted(durations)
+            percentile = lambda fraction: ordered[int(fraction * (len(ordered) - 1))] * 1000
+            rows.append((name, durations[-1] * 1000, percentile(0.5), percentile(0.95)))
+        return rows
+
+    def close(self):
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
+
+# The input cut to fit a pane of the given width after paddingString, measured in terminal columns
 def stringLimitedToWidth(input, width, paddingString = ""):
-    paddingString.replace("\t", "    ")
     replacedInput = input.replace("\t", "    ")
-    
-    wLimit = min((width - len(paddingString) - 3), len(replacedInput)) # I don't know why I need to subtract 3, but it overflows otherwise. It might be the padding
-    return input[0:wLimit]
-
-def listLimitedToHeight(list, limit):
-    limit = min(len(list), limit) # If the list goes off screen it will crash
-    return list[0: limit]
+    # the pane border takes 2 columns, and the last column is left free for the cursor
+    width -= displayWidth(paddingString.replace("\t", "    ")) + 3
+    if replacedInput.isascii() and replacedInput.isprintable():
+        return replacedInput[:max(width, 0)]
+    return truncatedToWidth(replacedInput, width)
+
+# The longest prefix of the text that takes at most width columns
+def truncatedToWidth(text, width):
+    if (text.isascii() and text.isprintable()) or isNarrow(text):
+        return text[:max(width, 0)]
+    columns = itertools.accumulate(map(CHARACTER_WIDTHS.__getitem__, text))
+    return text[:bisect.bisect_right(list(columns), width)]
+
+def displayWidth(text):
+    if (text.isascii() and text.isprintable()) or isNarrow(text):
+        return len(text)
+    return sum(map(CHARACTER_WIDTHS.__getitem__, text))
+
+CHARACTER_WIDTHS = { chr(code): 1 for code in range(32, 127) } # character -> columns, for the characters met so far
+NARROW_CHARACTERS = set(CHARACTER_WIDTHS) # the ones taking one column
+
+# Whether every character of the text takes one column, the common case even outside ASCII.
+# The characters not met before are measured and added to CHARACTER_WIDTHS
+def isNarrow(text):
+    characters = set(text)
+    if characters.issubset(NARROW_CHARACTERS):
+        return True
+    for character in characters.difference(CHARACTER_WIDTHS):
+        CHARACTER_WIDTHS[character] = characterWidth(character)
+        if CHARACTER_WIDTHS[character] == 1:
+            NARROW_CHARACTERS.add(character)
+    return characters.issubset(NARROW_CHARACTERS)
+
+# Columns taken by a character, like wcwidth: 2 for wide East Asian characters, 0 for combining marks
+# and format characters, and 2 for control characters, which curses draws as ^X
+def characterWidth(character):
+    import unicodedata
+    if character < " " or character == "\x7f":
+        return 2
+    if unicodedata.combining(character) or unicodedata.category(character) in ("Mn", "Me", "Cf"):
+        return 0
+    if unicodedata.east_asian_width(character) in ("W", "F"):
+        return 2
+    return 1
 
 def incrementWithLimit(value : int, limit: int):
     value += 1
@@ -602,6 +3190,9 @@ def incrementWithLimit(value : int, limit: int):
 # Main
 #
 
+PROFILE = StartupProfile()
+PROFILE.phases.append(("import", 0, IMPORT_TIME - STARTUP_TIME))
+
 if __name__ == '__main__':
 
     helpIfNeeded()
@@ -609,8 +3200,24 @@ if __name__ == '__main__':
     # Add current path to execute recipe at the right level
     sys.path.append(os.getcwd())
 
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        exit(COMMANDS[sys.argv[1]](sys.argv[2:]))
+
+    _, options = parsedArguments(sys.argv[1:], OPTIONS_WITH_VALUE)
+    if "--shell-init" in options:
+        exit(printShellInit(options["--shell-init"]))
+
+    if "--daemon" in options:
+        Daemon().serve()
+        exit(0)
+
     config = Config()
 
-    isDebugEnabled = "--debug" in sys.argv
-    recp = ReCP(config, isDebugEnabled)
+    isDebugEnabled = "--debug" in options
+    isProfilingStartup = "--profile-startup" in options
+    recp = ReCP(config, isDebugEnabled, isProfilingStartup, options.get("--output"), options.get("--trace"))
     recp.runloop()
+
+    if isProfilingStartup:
+        recp.historyLoader.join()
+        PROFILE.report()
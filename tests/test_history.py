@@ -0,0 +1,56 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import recp
+
+
+class HistoryReplacedTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.previousEnvironment = { name: os.environ.get(name) for name in ["HOME", "SHELL", "HISTFILE", "XDG_CACHE_HOME", "XDG_DATA_HOME"] }
+        os.environ["HOME"] = self.directory.name
+        os.environ["SHELL"] = "/bin/zsh"
+        os.environ["XDG_CACHE_HOME"] = os.path.join(self.directory.name, "cache")
+        os.environ["XDG_DATA_HOME"] = os.path.join(self.directory.name, "data")
+        os.environ.pop("HISTFILE", None)
+        self.path = os.path.join(self.directory.name, ".zsh_history")
+        self.write(["ls", "git status"])
+
+    def tearDown(self):
+        for name, value in self.previousEnvironment.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        self.directory.cleanup()
+
+    # the way zsh saves its history: a new file renamed over the old one
+    def write(self, commands):
+        tempPath = f"{self.path}.new"
+        with open(tempPath, 'w') as file:
+            file.writelines(f": {1700000000 + i}:0;{command}\n" for i, command in enumerate(commands))
+        os.replace(tempPath, self.path)
+
+    def testRefreshSignalsReplacedFile(self):
+        sources = recp.HistorySources([self.path])
+        sources.load()
+        self.write(["ls", "git status", "make"])
+        self.assertIsNone(sources.refresh())
+
+    def testDaemonDoesNotCountRewrittenCommandsTwice(self):
+        daemon = recp.Daemon()
+        daemon.loadHistory()
+        version = daemon.historyIndex.version
+        self.write(["ls", "git status", "make"])
+        daemon.refresh()
+
+        index = daemon.historyIndex
+        self.assertEqual(sorted((command, index.count(command)) for command in index.commands()), [("git status", 1), ("ls", 1), ("make", 1)])
+        self.assertGreater(index.version, version)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import recp
+
+
+class RecipeStoreJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.previousCache = os.environ.get("XDG_CACHE_HOME")
+        os.environ["XDG_CACHE_HOME"] = os.path.join(self.directory.name, "cache")
+        self.previousCompaction = recp.JOURNAL_COMPACTION_ENTRIES
+        recp.JOURNAL_COMPACTION_ENTRIES = 3
+
+        self.path = os.path.join(self.directory.name, ".recp")
+        with open(self.path, 'w') as file:
+            json.dump({ 'journal': True, 'recipes': [ recipe("b1") ] }, file)
+
+    def tearDown(self):
+        recp.JOURNAL_COMPACTION_ENTRIES = self.previousCompaction
+        if self.previousCache is None:
+            del os.environ["XDG_CACHE_HOME"]
+        else:
+            os.environ["XDG_CACHE_HOME"] = self.previousCache
+        self.directory.cleanup()
+
+    def titlesOnDisk(self):
+        store = recp.RecipeStore(self.path)
+        store.load()
+        return list(map(lambda x: x['title'], store.recipes))
+
+    # B compacts after A folded the journal and wrote it again past the offset B had read
+    def testStaleInstanceDoesNotOverwriteCompaction(self):
+        first = recp.RecipeStore(self.path)
+        second = recp.RecipeStore(self.path)
+        first.load()
+        second.load()
+
+        for title in ["a1", "a2", "a3", "a4"]:
+            first.add(recipe(title))
+        for title in ["b2", "b3", "b4"]:
+            second.add(recipe(title))
+
+        self.assertEqual(sorted(self.titlesOnDisk()), ["a1", "a2", "a3", "a4", "b1", "b2", "b3", "b4"])
+        self.assertEqual(sorted(map(lambda x: x['title'], second.recipes)), ["a1", "a2", "a3", "a4", "b1", "b2", "b3", "b4"])
+
+    def testRemoveAfterCompactionByOtherInstance(self):
+        first = recp.RecipeStore(self.path)
+        second = recp.RecipeStore(self.path)
+        first.load()
+        second.load()
+
+        for title in ["a1", "a2", "a3"]:
+            first.add(recipe(title))
+        second.remove("echo a1")
+
+        self.assertEqual(sorted(self.titlesOnDisk()), ["a2", "a3", "b1"])
+
+
+class RecipeStoreWriteTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.previousCache = os.environ.get("XDG_CACHE_HOME")
+        os.environ["XDG_CACHE_HOME"] = os.path.join(self.directory.name, "cache")
+
+    def tearDown(self):
+        if self.previousCache is None:
+            del os.environ["XDG_CACHE_HOME"]
+        else:
+            os.environ["XDG_CACHE_HOME"] = self.previousCache
+        self.directory.cleanup()
+
+    def testWriteThroughSymlinkKeepsLinkAndMode(self):
+        target = os.path.join(self.directory.name, "dotfiles", "recp.json")
+        os.makedirs(os.path.dirname(target))
+        with open(target, 'w') as file:
+            json.dump({ 'recipes': [] }, file)
+        os.chmod(target, 0o600)
+        link = os.path.join(self.directory.name, ".recp")
+        os.symlink(target, link)
+
+        store = recp.RecipeStore(link)
+        store.load()
+        store.add(recipe("a1"))
+
+        self.assertTrue(os.path.islink(link))
+        with open(target) as file:
+            self.assertEqual(json.load(file)['recipes'], [ recipe("a1") ])
+        self.assertEqual(os.stat(target).st_mode & 0o777, 0o600)
+
+
+def recipe(title):
+    return { 'title': title, 'recipe': f"echo {title}" }
+
+
+if __name__ == '__main__':
+    unittest.main()